@@ -0,0 +1,160 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом в один.
+    Пока запрос по ключу выполняется, остальные вызовы ждут его результат
+    (или исключение), а не делают собственный запрос.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        :param key: ключ объединения (например, город)
+        :param func: фабрика корутины, которая выполняет настоящий запрос
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Если все ожидающие отменились, не даём asyncio ругаться на непрочитанное исключение
+        if not task.cancelled():
+            task.exception()
+
+
+class LRUCache:
+    """
+    Простой LRU-кэш с ограничением по «весу» записей и необязательным TTL.
+    По умолчанию вес каждой записи равен 1, т.е. ограничивается число записей.
+    """
+
+    def __init__(self, max_weight: int, ttl: float | None = None, weigher: Callable[[Any], int] | None = None):
+        """
+        :param max_weight: максимальный суммарный вес записей
+        :param ttl: время жизни записи в секундах (None — без ограничения)
+        :param weigher: функция, вычисляющая вес значения (например, len для bytes)
+        """
+        self.max_weight = max_weight
+        self.ttl = ttl
+        self._weigher = weigher or (lambda value: 1)
+        self._data: "OrderedDict[Hashable, tuple[Any, int, float]]" = OrderedDict()
+        self._weight = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, _, expires_at = item
+        if expires_at and expires_at < time.monotonic():
+            self.pop(key)
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        weight = self._weigher(value)
+        if weight > self.max_weight:
+            return
+        self.pop(key)
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0.0
+        self._data[key] = (value, weight, expires_at)
+        self._weight += weight
+        while self._weight > self.max_weight:
+            _, (_, old_weight, _) = self._data.popitem(last=False)
+            self._weight -= old_weight
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        self._weight -= item[1]
+        return item[0]
+
+    def clear(self):
+        self._data.clear()
+        self._weight = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MISSING = object()
+
+
+class MicroBatcher:
+    """
+    Собирает одиночные запросы, пришедшие за короткое окно, в один пакет.
+    Обработчик пакета получает список элементов и должен вернуть список
+    результатов той же длины; каждый вызывающий получает свой результат.
+    """
+
+    def __init__(self, handler: Callable[[list], Awaitable[list]], max_batch: int = 32, max_delay: float = 0.02):
+        """
+        :param handler: корутина, обрабатывающая пакет элементов
+        :param max_batch: максимальный размер пакета
+        :param max_delay: сколько секунд ждать, пока пакет наполнится
+        """
+        self._handler = handler
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: list[tuple[Any, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        # Ссылки на задачи пакетов: цикл событий хранит только слабые, без них задачу может собрать GC
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[Any, asyncio.Future]]):
+        try:
+            results = await self._handler([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError("Размер ответа не совпадает с размером пакета")
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # Задачу пакета отменили (или вылетел BaseException) — вызывающие не должны ждать вечно
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Обработка пакета прервана"))
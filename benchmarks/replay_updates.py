@@ -0,0 +1,459 @@
+"""
+Офлайн-бенчмарк: прогоняет записанные или синтетические обновления Telegram
+через dp.feed_update диспетчеров main.py, fsm_test.py и test_TG04.py.
+
+Сеть не используется: сессия Bot подменяется заглушкой, внешние API
+(OpenWeather, gTTS, googletrans, DaData) — фейками с настраиваемой задержкой,
+SQLite работает во временном каталоге.
+
+Примеры:
+    python benchmarks/replay_updates.py                       # синтетические обновления
+    python benchmarks/replay_updates.py --updates benchmarks/updates_sample.jsonl
+    python benchmarks/replay_updates.py --generate 50 > my_updates.jsonl
+    python benchmarks/replay_updates.py --json results.json --concurrency 32
+    python benchmarks/replay_updates.py --update-scheduler    # через UpdateScheduler, как в проде
+
+Формат JSONL: {"bot": "main" | "fsm" | "tg04", "update": {...}} в каждой строке.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import types
+from collections import defaultdict
+from typing import Any, AsyncGenerator
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import TelegramMethod  # noqa: E402
+from aiogram.types import Chat, File, Message, PhotoSize, Update, Voice  # noqa: E402
+
+BOT_NAMES = ("main", "fsm", "tg04")
+FAKE_TOKEN = "123456:BENCHMARK"
+
+
+# --- Заглушки внешнего мира ---
+def install_fake_config():
+    """
+    config.py с токенами не хранится в репозитории — для бенчмарка подойдут фейковые значения.
+    """
+    try:
+        import config  # noqa: F401
+    except ImportError:
+        config = types.ModuleType("config")
+        config.TG_TOKEN = FAKE_TOKEN
+        config.OPENWEATHER_API_KEY = "benchmark"
+        config.DADATA_TOKEN = "benchmark"
+        config.DATA_SECRET_KEY = "benchmark"
+        sys.modules["config"] = config
+
+
+class MockSession(BaseSession):
+    """
+    Сессия Bot, которая не ходит в сеть, а сразу возвращает правдоподобный ответ.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests: dict[str, int] = defaultdict(int)
+        self._message_id = 0
+
+    async def close(self):
+        pass
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int | None = None) -> Any:
+        self.requests[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        returning = method.__returning__
+        if returning is bool:
+            return True
+        if returning is Message:
+            return self._fake_message(method)
+        if returning is File:
+            file_id = getattr(method, "file_id", "file")
+            return File(file_id=file_id, file_unique_id=f"u-{file_id}", file_path=f"photos/{file_id}.jpg")
+        return None
+
+    async def stream_content(self, url: str, headers: dict[str, Any] | None = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        # Содержимое зависит от URL, чтобы дедупликация по хэшу работала как в жизни
+        yield f"fake image {url}".encode() * 64
+
+    def _fake_message(self, method: TelegramMethod) -> Message:
+        self._message_id += 1
+        chat_id = getattr(method, "chat_id", 0) or 0
+        extra = {}
+        if type(method).__name__ == "SendPhoto":
+            extra["photo"] = [PhotoSize(file_id=f"photo-{self._message_id}", file_unique_id=f"p{self._message_id}",
+                                        width=1, height=1)]
+        elif type(method).__name__ == "SendVoice":
+            extra["voice"] = Voice(file_id=f"voice-{self._message_id}", file_unique_id=f"v{self._message_id}",
+                                   duration=1)
+        return Message(
+            message_id=self._message_id,
+            date=datetime.datetime.now(),
+            chat=Chat(id=chat_id, type="private"),
+            text=getattr(method, "text", None),
+            **extra,
+        )
+
+
+def install_external_stubs(upstream_latency: float):
+    """
+    Подменяет вызовы внешних API на фейки с задержкой upstream_latency секунд.
+    """
+    import httpx
+
+    import main
+    import test_TG04
+    import weather_service
+    from dadata_client import DadataAPI
+
+    class FakeResponse:
+        status_code = 200
+
+        @staticmethod
+        def json():
+            return {"main": {"temp": 20, "humidity": 50}, "weather": [{"description": "ясно"}], "wind": {"speed": 3}}
+
+    class FakeHttpClient:
+        async def get(self, url, params=None):
+            await asyncio.sleep(upstream_latency)
+            return FakeResponse()
+
+    weather_service.get_http_client = lambda: FakeHttpClient()
+
+    def fake_tts(text: str, lang: str) -> bytes:
+        time.sleep(upstream_latency)  # синтез идёт в пуле потоков — блокирующая задержка уместна
+        return f"{lang}:{text}".encode() * 100
+
+    main.tts_cache._synthesize_sync = fake_tts
+
+    class FakeTranslated:
+        def __init__(self, text):
+            self.text = text
+
+    class FakeTranslator:
+        async def translate(self, text, src="auto", dest="en"):
+            await asyncio.sleep(upstream_latency)
+            return FakeTranslated(f"[{dest}] {text}")
+
+    main.translator._translator = FakeTranslator()
+
+    async def fake_dadata(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(upstream_latency)
+        if request.url.path.endswith("/clean/address"):
+            return httpx.Response(200, json=[{"result": f"г Москва, {address}", "qc": 0, "postal_code": "101000",
+                                              "house_cadnum": "77:01:0001001:1"}
+                                             for address in json.loads(request.content)])
+        if request.url.path.endswith("/findById/address"):
+            return httpx.Response(200, json={"suggestions": [{"value": "г Москва", "data": {"postal_code": "101000"}}]})
+        return httpx.Response(200, json={"location": {"value": "г Москва", "data": {"city": "Москва"}}})
+
+    # Настоящий DadataAPI (пул, семафор, таймауты), но без сети
+    test_TG04.dadata = DadataAPI(test_TG04.HEADERS, transport=httpx.MockTransport(fake_dadata))
+
+
+# --- Синтетические обновления ---
+class UpdateFactory:
+    def __init__(self):
+        self.update_id = 0
+
+    def _next(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    @staticmethod
+    def _user(chat_id: int) -> dict:
+        return {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"}
+
+    def message(self, chat_id: int, text: str | None = None, photo_id: str | None = None) -> dict:
+        update_id = self._next()
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._user(chat_id),
+        }
+        if photo_id is not None:
+            message["photo"] = [{"file_id": photo_id, "file_unique_id": f"u-{photo_id}", "width": 640, "height": 480}]
+        else:
+            message["text"] = text
+            if text.startswith("/"):
+                command = text.split(maxsplit=1)[0]
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, chat_id: int, data: str) -> dict:
+        update_id = self._next()
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(chat_id),
+                "chat_instance": str(chat_id),
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": "menu",
+                },
+            },
+        }
+
+
+def generate_updates(users: int) -> list[dict]:
+    """
+    Генерирует сценарии для каждого бота: по одному пользователю (чату) на сценарий.
+    """
+    factory = UpdateFactory()
+    records = []
+
+    def add(bot_name: str, update: dict):
+        records.append({"bot": bot_name, "update": update})
+
+    for user in range(users):
+        chat_id = 1000 + user
+        for text in ("/start", "/help", "/weather", f"/voice_ru Привет {user % 5}",
+                     f"/voice_en Как дела {user % 5}", "/photo", "что такое ИИ?", "просто текст"):
+            add("main", factory.message(chat_id, text))
+        add("main", factory.message(chat_id, photo_id=f"photo{user % 10}"))
+
+        # Латиница и фиксированная ширина: LIKE-поиск находит ровно одного студента
+        name = f"Student-{user:05d}"
+        for text in ("/add", name, str(10 + user % 8), f"{5 + user % 6}А", "/find_by_grade", f"{5 + user % 6}а",
+                     "/find_by_name", name[:7]):
+            add("fsm", factory.message(chat_id, text))
+        add("fsm", factory.callback(chat_id, "list_next"))
+        add("fsm", factory.message(chat_id, "/stats"))
+        add("fsm", factory.message(chat_id, "/edit"))
+        add("fsm", factory.message(chat_id, name))
+        add("fsm", factory.callback(chat_id, "edit_age"))
+        add("fsm", factory.message(chat_id, "12"))
+        add("fsm", factory.message(chat_id, "/del"))
+        add("fsm", factory.message(chat_id, name))
+        add("fsm", factory.callback(chat_id, "confirm_delete"))
+
+        add("tg04", factory.message(chat_id, "/start"))
+        add("tg04", factory.callback(chat_id, "hello"))
+        add("tg04", factory.message(chat_id, "/ip_town"))
+        add("tg04", factory.message(chat_id, f"77.88.{user % 256}.1"))
+        add("tg04", factory.message(chat_id, "/address"))
+        add("tg04", factory.message(chat_id, f"ул Ленина {user % 7}"))
+        add("tg04", factory.message(chat_id, "/address_to_cad"))
+        add("tg04", factory.message(chat_id, f"ул Мира {user}"))
+        add("tg04", factory.message(chat_id, "/cad"))
+        add("tg04", factory.message(chat_id, f"77:01:0001001:{user}"))
+        add("tg04", factory.message(chat_id, "/dynamic"))
+        add("tg04", factory.callback(chat_id, "show_more"))
+    return records
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# --- Замер времени ---
+class HandlerTimer:
+    """
+    Inner-middleware: замеряет время работы каждого обработчика по его имени.
+    """
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors[name] += 1
+            raise
+        finally:
+            self.latencies[name].append(time.perf_counter() - start)
+
+
+def percentile(values: list[float], q: float) -> float:
+    # Перцентиль по методу ближайшего ранга
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def build_dispatchers(workdir: str) -> dict[str, Dispatcher]:
+    """
+    Импортирует модули ботов внутри временного каталога (там же создаются img/, БД и кэши).
+    """
+    os.chdir(workdir)
+    import fsm_test
+    import main
+    import test_TG04
+
+    fsm_test.DB_NAME = os.path.join(workdir, "school_data.db")
+    from fsm_storage import SQLiteStorage
+    tg04_dp = Dispatcher(storage=SQLiteStorage(os.path.join(workdir, "fsm_storage_tg04.db")))
+    tg04_dp.include_router(test_TG04.router)
+    return {"main": main.dp, "fsm": fsm_test.dp, "tg04": tg04_dp}
+
+
+async def replay(dp: Dispatcher, bot: Bot, updates: list[dict], concurrency: int,
+                 update_scheduler: bool = False) -> tuple[HandlerTimer, float]:
+    """
+    Прогоняет обновления: разные чаты параллельно (до concurrency), один чат — строго по порядку.
+    С update_scheduler обновления подаются по одному в порядке поступления, как при polling,
+    а порядок и параллельность обеспечивает UpdateScheduler.
+    """
+    timer = HandlerTimer()
+    dp.message.middleware(timer)
+    dp.callback_query.middleware(timer)
+
+    if update_scheduler:
+        from update_scheduler import setup_update_scheduler
+        scheduler = setup_update_scheduler(dp, concurrency)
+        start = time.perf_counter()
+        for raw in updates:
+            await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+        await scheduler.join()
+        elapsed = time.perf_counter() - start
+        dp.update.outer_middleware.unregister(scheduler)
+        dp.message.middleware.unregister(timer)
+        dp.callback_query.middleware.unregister(timer)
+        return timer, elapsed
+
+    by_chat: dict[int, list[Update]] = defaultdict(list)
+    for raw in updates:
+        update = Update.model_validate(raw, context={"bot": bot})
+        event = update.message or update.callback_query
+        by_chat[event.from_user.id if event.from_user else 0].append(update)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_chat(chat_updates: list[Update]):
+        async with semaphore:
+            for update in chat_updates:
+                try:
+                    await dp.feed_update(bot, update)
+                except Exception as e:
+                    print(f"Ошибка при обработке update {update.update_id}: {e!r}", file=sys.stderr)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_chat(chat_updates) for chat_updates in by_chat.values()))
+    elapsed = time.perf_counter() - start
+
+    dp.message.middleware.unregister(timer)
+    dp.callback_query.middleware.unregister(timer)
+    return timer, elapsed
+
+
+def summarize(bot_name: str, timer: HandlerTimer, elapsed: float) -> list[dict]:
+    rows = []
+    for handler_name, latencies in sorted(timer.latencies.items()):
+        rows.append({
+            "bot": bot_name,
+            "handler": handler_name,
+            "count": len(latencies),
+            "errors": timer.errors.get(handler_name, 0),
+            "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        })
+    return rows
+
+
+def print_table(rows: list[dict]):
+    header = f"{'bot':<5} {'handler':<24} {'count':>6} {'err':>4} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['bot']:<5} {row['handler']:<24} {row['count']:>6} {row['errors']:>4} "
+              f"{row['throughput_per_s']:>9.1f} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+
+
+async def run(args) -> list[dict]:
+    install_fake_config()
+    records = load_updates(args.updates) if args.updates else generate_updates(args.users)
+    workdir = tempfile.mkdtemp(prefix="aig_bot_bench_")
+    dispatchers = build_dispatchers(workdir)
+    install_external_stubs(args.upstream_latency)
+
+    import fsm_test
+    import main
+
+    session = MockSession(latency=args.api_latency)
+    if args.send_scheduler:
+        # Очередь исходящих с реальными лимитами Telegram: показывает задержки из-за rate limit
+        from send_scheduler import SendScheduler
+        session.middleware(SendScheduler())
+    bot = Bot(token=FAKE_TOKEN, session=session)
+    # Модули держат собственные экземпляры Bot — направляем их в ту же заглушку
+    main.bot.session = session
+    fsm_test.bot.session = session
+    await fsm_test.init_db()
+    await main.photo_ingest.start()
+
+    rows = []
+    for bot_name in args.bots:
+        updates = [record["update"] for record in records if record["bot"] == bot_name]
+        if not updates:
+            continue
+        timer, elapsed = await replay(dispatchers[bot_name], bot, updates, args.concurrency,
+                                      args.update_scheduler)
+        rows.extend(summarize(bot_name, timer, elapsed))
+        print(f"{bot_name}: {len(updates)} обновлений за {elapsed:.3f} с ({len(updates) / elapsed:.1f} upd/s)")
+
+    await main.photo_ingest.join()
+    await main.photo_ingest.stop()
+    await fsm_test.database.close()
+    for dp in dispatchers.values():
+        await dp.storage.close()
+    return rows
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк обработчиков ботов")
+    parser.add_argument("--updates", help="JSONL-файл с обновлениями (по умолчанию — синтетические)")
+    parser.add_argument("--users", type=int, default=20, help="число синтетических пользователей")
+    parser.add_argument("--bots", nargs="+", choices=BOT_NAMES, default=list(BOT_NAMES))
+    parser.add_argument("--concurrency", type=int, default=16, help="сколько чатов обрабатывать одновременно")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Telegram API, с")
+    parser.add_argument("--upstream-latency", type=float, default=0.005, help="задержка внешних API, с")
+    parser.add_argument("--send-scheduler", action="store_true",
+                        help="пропускать исходящие запросы через SendScheduler")
+    parser.add_argument("--update-scheduler", action="store_true",
+                        help="подавать обновления через UpdateScheduler (--concurrency — его лимит)")
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    parser.add_argument("--generate", type=int, metavar="USERS",
+                        help="только напечатать синтетические обновления в JSONL и выйти")
+    args = parser.parse_args()
+
+    if args.generate:
+        for record in generate_updates(args.generate):
+            print(json.dumps(record, ensure_ascii=False))
+        return
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    rows = asyncio.run(run(args))
+    print()
+    print_table(rows)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
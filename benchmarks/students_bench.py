@@ -0,0 +1,287 @@
+"""
+Нагрузочный бенчмарк базы студентов fsm_test.py.
+
+Создаёт синтетическую school_data.db нужного размера (вплоть до миллионов строк)
+и замеряет те же запросы, что выполняют обработчики: поиск по имени (FTS5 и LIKE),
+выбор студента для /edit и /del, поиск по классу, по ID, /stats, INSERT, UPDATE, DELETE.
+Каждый запрос прогоняется в одиночку (concurrency 1) и под параллельной нагрузкой asyncio.
+Схема и индексы создаются тем же init_db(), что и в боте, поэтому после изменения
+схемы достаточно перезапустить бенчмарк и сравнить JSON-результаты.
+
+Примеры:
+    python benchmarks/students_bench.py --rows 100000
+    python benchmarks/students_bench.py --rows 1000000 --db /tmp/school_1m.db --reuse
+    python benchmarks/students_bench.py --rows 200000 --concurrency 1 8 32 --json before.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from database import casefold  # noqa: E402
+from replay_updates import install_fake_config, percentile  # noqa: E402
+
+LOAD_CHUNK_SIZE = 50_000
+
+FIRST_NAMES = ("Александр", "Мария", "Иван", "Анна", "Дмитрий", "Елена", "Сергей", "Ольга", "Михаил",
+               "Татьяна", "Андрей", "Наталья", "Алексей", "Екатерина", "Никита", "Софья", "Артём", "Полина")
+LAST_NAMES = ("Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов",
+              "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семёнов", "Егоров")
+GRADE_LETTERS = "АБВГД"
+
+
+# --- Синтетические данные ---
+def random_student(rng: random.Random) -> tuple[str, int, str, str]:
+    number = rng.randint(1, 11)
+    name = f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.randint(1, 999_999):06d}"
+    data = datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=rng.randint(0, 60_000_000))
+    return name, number + 6, f"{number}{rng.choice(GRADE_LETTERS)}", data.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def create_database(path: str, rows: int, seed: int):
+    """
+    Заполняет таблицу students без индексов и триггеров: их затем создаёт init_db()
+    (как миграция существующей базы), это намного быстрее построчного обновления индексов.
+    """
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=OFF")
+    connection.execute('''
+        CREATE TABLE students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            age INTEGER NOT NULL,
+            grade TEXT NOT NULL,
+            data DATETIME NOT NULL
+        )
+    ''')
+    done = 0
+    while done < rows:
+        size = min(LOAD_CHUNK_SIZE, rows - done)
+        connection.executemany("INSERT INTO students (name, age, grade, data) VALUES (?, ?, ?, ?)",
+                               (random_student(rng) for _ in range(size)))
+        connection.commit()
+        done += size
+        print(f"\rСоздано строк: {done}/{rows}", end="", file=sys.stderr)
+    print(file=sys.stderr)
+    connection.close()
+
+
+def count_rows(path: str) -> int:
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT COUNT(*) FROM students").fetchone()[0]
+    except sqlite3.Error:
+        return -1
+    finally:
+        connection.close()
+
+
+# --- Запросы обработчиков ---
+class Workload:
+    """
+    Запросы в том виде, в каком их выполняют обработчики fsm_test.py.
+    Кэш студентов отключён (нулевой размер), чтобы замерялась сама база.
+    """
+
+    def __init__(self, fsm_test, seed: int):
+        from student_cache import StudentCache
+
+        self.fsm_test = fsm_test
+        self.database = fsm_test.database
+        self.cache = StudentCache(self.database, size=0, grade_size=0)
+        self.rng = random.Random(seed)
+        self.max_id = 0
+        self.inserted_ids: list[int] = []
+
+    async def prepare(self):
+        row = await self.database.fetchone("SELECT MAX(id) FROM students")
+        self.max_id = row[0] or 0
+
+    def _random_id(self) -> int:
+        return self.rng.randint(1, max(self.max_id, 1))
+
+    def _random_grade(self) -> str:
+        return f"{self.rng.randint(1, 11)}{self.rng.choice(GRADE_LETTERS)}"
+
+    async def name_search(self):
+        # process_find_by_name: первая страница, от 3 символов — FTS5-индекс триграмм
+        await self.fsm_test.fetch_students_page(f"{self.rng.randint(0, 999_999):06d}"[:4])
+
+    async def name_search_short(self):
+        # Короткий запрос (1–2 символа) ищется перебором через LIKE
+        await self.fsm_test.fetch_students_page(self.rng.choice(FIRST_NAMES)[:2])
+
+    async def name_select(self):
+        # edit_select_student / delete_select_student при вводе имени
+        await self.fsm_test.search_students_by_name(self.rng.choice(LAST_NAMES), "id, name, age, grade", limit=5)
+
+    async def grade_lookup(self):
+        # process_find_by_grade
+        await self.cache.get_grade(self._random_grade().lower())
+
+    async def id_lookup(self):
+        # edit_select_student / delete_select_student при вводе ID
+        await self.cache.get_student(self._random_id())
+
+    async def stats(self):
+        # cmd_stats
+        await self.database.fetchall("SELECT grade, count, age_sum FROM grade_stats ORDER BY grade_norm")
+
+    async def insert(self):
+        # process_grade
+        name, age, grade, _ = random_student(self.rng)
+        student_id = await self.database.execute(self.fsm_test.INSERT_STUDENT_SQL,
+                                                 (name, age, grade, casefold(grade), datetime.datetime.now()))
+        self.inserted_ids.append(student_id)
+
+    async def update(self):
+        # edit_set_value: чтение старой строки, затем UPDATE
+        student_id = self._random_id()
+        await self.cache.get_student(student_id)
+        if self.rng.random() < 0.5:
+            await self.database.execute('UPDATE students SET age = ?, data = ? WHERE id = ?',
+                                        (self.rng.randint(7, 18), datetime.datetime.now(), student_id))
+        else:
+            grade = self._random_grade()
+            await self.database.execute('UPDATE students SET grade = ?, grade_norm = ?, data = ? WHERE id = ?',
+                                        (grade, casefold(grade), datetime.datetime.now(), student_id))
+
+    async def delete(self):
+        # confirm_delete: удаляем студентов, добавленных в insert, чтобы размер таблицы не менялся
+        student_id = self.inserted_ids.pop() if self.inserted_ids else self._random_id()
+        await self.cache.get_student(student_id)
+        await self.database.execute('DELETE FROM students WHERE id = ?', (student_id,))
+
+
+QUERIES = ("name_search", "name_search_short", "name_select", "grade_lookup", "id_lookup", "stats",
+           "insert", "update", "delete")
+
+
+async def measure(operation, ops: int, concurrency: int) -> tuple[list[float], float, int]:
+    """
+    Выполняет ops операций, не больше concurrency одновременно.
+    :return: (латентности, общее время, число ошибок)
+    """
+    latencies: list[float] = []
+    errors = 0
+    remaining = iter(range(ops))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                await operation()
+            except Exception as e:
+                errors += 1
+                print(f"Ошибка {operation.__name__}: {e!r}", file=sys.stderr)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, errors
+
+
+async def run(args) -> dict:
+    install_fake_config()
+    import fsm_test
+
+    if args.reuse and os.path.exists(args.db) and count_rows(args.db) >= args.rows:
+        print(f"Используется существующая база {args.db}", file=sys.stderr)
+    else:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+        create_database(args.db, args.rows, args.seed)
+
+    fsm_test.DB_NAME = args.db
+    start = time.perf_counter()
+    await fsm_test.init_db()
+    migrate_seconds = time.perf_counter() - start
+
+    workload = Workload(fsm_test, args.seed)
+    await workload.prepare()
+    rows = await fsm_test.database.fetchone("SELECT COUNT(*) FROM students")
+
+    results = []
+    for concurrency in args.concurrency:
+        for name in args.queries:
+            latencies, elapsed, errors = await measure(getattr(workload, name), args.ops, concurrency)
+            results.append({
+                "query": name,
+                "concurrency": concurrency,
+                "ops": len(latencies),
+                "errors": errors,
+                "ops_per_s": len(latencies) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "max_ms": max(latencies) * 1000,
+            })
+
+    await fsm_test.database.close()
+    return {
+        "meta": {
+            "rows": rows[0],
+            "db": args.db,
+            "db_size_bytes": os.path.getsize(args.db),
+            "sqlite_version": sqlite3.sqlite_version,
+            "python": sys.version.split()[0],
+            "ops": args.ops,
+            "seed": args.seed,
+            "init_db_seconds": migrate_seconds,
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+
+
+def print_table(report: dict):
+    meta = report["meta"]
+    print(f"Строк: {meta['rows']}, размер базы: {meta['db_size_bytes'] / 2**20:.1f} МБ, "
+          f"init_db: {meta['init_db_seconds']:.2f} с, SQLite {meta['sqlite_version']}")
+    header = f"{'query':<18} {'conc':>5} {'ops':>6} {'err':>4} {'ops/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in report["results"]:
+        print(f"{row['query']:<18} {row['concurrency']:>5} {row['ops']:>6} {row['errors']:>4} "
+              f"{row['ops_per_s']:>9.1f} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Бенчмарк запросов к базе студентов")
+    parser.add_argument("--rows", type=int, default=100_000, help="число студентов в синтетической базе")
+    parser.add_argument("--db", help="путь к базе (по умолчанию — во временном каталоге)")
+    parser.add_argument("--reuse", action="store_true",
+                        help="не пересоздавать базу, если в ней уже не меньше --rows строк")
+    parser.add_argument("--ops", type=int, default=500, help="операций на каждый запрос и уровень нагрузки")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64],
+                        help="уровни параллельности (1 — запрос в одиночку)")
+    parser.add_argument("--queries", nargs="+", choices=QUERIES, default=list(QUERIES))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+    args.db = os.path.abspath(args.db or os.path.join(tempfile.mkdtemp(prefix="aig_bot_students_"),
+                                                       "school_data.db"))
+
+    report = asyncio.run(run(args))
+    print()
+    print_table(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,114 @@
+import os
+from typing import Any
+
+import httpx
+
+from aio_utils import MicroBatcher
+from metrics import track_external
+from resilience import AdaptiveLimiter, Quota, Upstream
+
+# --- Настройки клиента DaData ---
+DADATA_TIMEOUT = httpx.Timeout(5.0, connect=3.0)
+DADATA_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+DADATA_MAX_CONCURRENCY = 10   # начальный лимит одновременных запросов (лимит тарифа — 20 в секунду)
+# Суточная квота тарифа (бесплатный — 10 000 запросов); 0 — только считать запросы
+DADATA_DAILY_QUOTA = int(os.getenv("DADATA_DAILY_QUOTA", "10000"))
+CLEAN_BATCH_SIZE = 10         # записей в одном запросе стандартизации
+CLEAN_BATCH_DELAY = 0.05      # секунд собираем записи от разных чатов в один запрос
+
+
+class DadataAPI:
+    """
+    Общий асинхронный клиент DaData: одно httpx-соединение с keep-alive на весь бот,
+    таймауты и устойчивость к сбоям сервиса (resilience.Upstream): адаптивный лимит
+    одновременных запросов, повторы с учётом Retry-After, предохранитель и учёт квоты.
+    Заголовки (токен, формат) и адреса методов задаёт вызывающий модуль.
+    Открывается при запуске (open), закрывается при остановке (close);
+    при первом запросе без open() клиент создаётся сам.
+    Стандартизация (clean) принимает массив записей: запросы разных чатов, пришедшие
+    за CLEAN_BATCH_DELAY, уходят одним HTTP-вызовом, и каждый получает свой результат.
+    """
+
+    def __init__(self, headers: dict[str, str], secret: str | None = None,
+                 timeout: httpx.Timeout = DADATA_TIMEOUT, limits: httpx.Limits = DADATA_LIMITS,
+                 max_concurrency: int = DADATA_MAX_CONCURRENCY, transport: httpx.AsyncBaseTransport | None = None):
+        """
+        :param headers: заголовки каждого запроса (Authorization, Accept, Content-Type)
+        :param secret: секретный ключ для методов стандартизации (заголовок X-Secret)
+        :param transport: свой транспорт httpx (например, MockTransport в бенчмарке)
+        """
+        self.headers = headers
+        self.secret = secret
+        self.timeout = timeout
+        self.limits = limits
+        self.transport = transport
+        self._upstream = Upstream(
+            "dadata",
+            limiter=AdaptiveLimiter("dadata", initial=max_concurrency, max_limit=2 * max_concurrency),
+            quota=Quota("dadata", DADATA_DAILY_QUOTA or None),
+        )
+        self._client: httpx.AsyncClient | None = None
+        self._clean_batchers: dict[str, MicroBatcher] = {}
+
+    async def open(self):
+        self._get_client()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(headers=self.headers, timeout=self.timeout,
+                                             limits=self.limits, transport=self.transport)
+        return self._client
+
+    async def request(self, method: str, url: str, secret: bool = False, retry: bool = True, **kwargs) -> Any:
+        """
+        Выполняет запрос и возвращает распарсенный JSON.
+        :param secret: добавить заголовок X-Secret
+        :param retry: повторять при таймауте и ошибках сервиса (False — для платных запросов)
+        :raises httpx.HTTPStatusError: ответ с кодом 4xx/5xx
+        :raises httpx.TransportError: ошибка соединения или таймаут
+        :raises resilience.UpstreamUnavailable: DaData сейчас недоступна, запрос не отправлялся
+        """
+        if secret:
+            kwargs["headers"] = {**kwargs.get("headers", {}), "X-Secret": self.secret or ""}
+
+        async def attempt():
+            async with track_external("dadata"):
+                response = await self._get_client().request(method, url, **kwargs)
+                response.raise_for_status()
+                return response.json()
+
+        return await self._upstream.call(attempt, retry=retry)
+
+    async def get(self, url: str, params: dict[str, Any] | None = None) -> Any:
+        return await self.request("GET", url, params=params)
+
+    async def post(self, url: str, data: Any, secret: bool = False, retry: bool = True) -> Any:
+        return await self.request("POST", url, secret=secret, retry=retry, json=data)
+
+    async def clean(self, url: str, record: str) -> dict | None:
+        """
+        Стандартизирует одну запись (адрес и т.п.) в составе общего пакета.
+        :param url: метод стандартизации, например .../clean/address
+        :return: стандартизированная запись или None, если сервис ничего не вернул
+        """
+        batcher = self._clean_batchers.get(url)
+        if batcher is None:
+            batcher = MicroBatcher(lambda records: self._clean_batch(url, records),
+                                   max_batch=CLEAN_BATCH_SIZE, max_delay=CLEAN_BATCH_DELAY)
+            self._clean_batchers[url] = batcher
+        return await batcher.submit(record)
+
+    async def _clean_batch(self, url: str, records: list[str]) -> list[dict | None]:
+        # Одинаковые записи из разных чатов стандартизируем один раз
+        unique = list(dict.fromkeys(records))
+        # Стандартизация тарифицируется за запись, а после таймаута пакет мог быть уже обработан — не повторяем
+        results = await self.post(url, unique, secret=True, retry=False)
+        if len(results) != len(unique):
+            raise RuntimeError("DaData вернула не столько записей, сколько было отправлено")
+        by_record = dict(zip(unique, results))
+        return [by_record[record] for record in records]
@@ -0,0 +1,197 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Iterable
+
+import aiosqlite
+
+from metrics import track_external
+
+# --- Настройки соединений ---
+READER_POOL_SIZE = 4
+WRITE_BATCH_SIZE = 128      # изменений в одной транзакции
+WRITE_BATCH_DELAY = 0.002   # секунд ожидания остальных изменений пакета
+STATEMENT_CACHE_SIZE = 256  # подготовленных выражений на соединение
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",       # читатели не блокируют писателя
+    "PRAGMA synchronous=NORMAL",     # в режиме WAL безопасно и намного быстрее FULL
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",      # ~16 МБ кэша страниц
+    "PRAGMA mmap_size=268435456",    # 256 МБ memory-mapped I/O
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
+
+
+def casefold(value: Any) -> Any:
+    """
+    Регистронезависимая нормализация для SQL (встроенный LOWER понимает только ASCII).
+    Доступна на соединениях бота как функция casefold() для запросов и миграций.
+    В триггерах её не используем: других клиентов SQLite (sqlite3 CLI, скрипты) она не знает.
+    """
+    return value.casefold() if isinstance(value, str) else value
+
+
+class Database:
+    """
+    Долгоживущие соединения с SQLite: одно соединение-писатель и пул читателей.
+    Соединения открываются один раз в open(), sqlite3 кэширует подготовленные
+    выражения на каждом соединении, поэтому одинаковый SQL не компилируется повторно.
+
+    Изменения через execute() выполняет одна фоновая задача-писатель с групповой
+    фиксацией: всё, что пришло за WRITE_BATCH_DELAY, коммитится одной транзакцией
+    (один fsync на пакет), и вызывающий получает результат после коммита пакета.
+    """
+
+    def __init__(self, readers: int = READER_POOL_SIZE):
+        self.path: str | None = None
+        self.readers = readers
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        # Семафор раздаёт читателей строго по очереди ожидания (asyncio.Queue.get этого
+        # не гарантирует: только что вернувший соединение тут же забирает его снова)
+        self._reader_slots = asyncio.Semaphore(0)
+        self._reader_pool: list[aiosqlite.Connection] = []
+        self._reader_connections: list[aiosqlite.Connection] = []
+        self._write_queue: asyncio.Queue[tuple[str, Iterable[Any], asyncio.Future]] = asyncio.Queue()
+        self._writer_task: asyncio.Task | None = None
+
+    async def open(self, path: str):
+        """
+        Открывает соединения с базой (вызывается из init_db).
+        :param path: путь к файлу базы данных
+        """
+        if self._writer is not None:
+            return
+        self.path = path
+        self._writer = await self._connect()
+        # Коммит пакета должен быть надёжным; цена fsync делится на весь пакет
+        await self._writer.execute("PRAGMA synchronous=FULL")
+        self._writer_task = asyncio.create_task(self._write_loop())
+        for _ in range(self.readers):
+            connection = await self._connect()
+            self._reader_connections.append(connection)
+            self._reader_pool.append(connection)
+            self._reader_slots.release()
+
+    async def _connect(self) -> aiosqlite.Connection:
+        connection = await aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            await connection.execute(pragma)
+        await connection.create_function("casefold", 1, casefold, deterministic=True)
+        return connection
+
+    async def close(self):
+        if self._writer_task is not None:
+            await self._write_queue.join()  # дописываем всё, что уже поставлено в очередь
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        for connection in self._reader_connections:
+            await connection.close()
+        self._reader_connections.clear()
+        self._reader_pool.clear()
+        self._reader_slots = asyncio.Semaphore(0)
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def reader(self):
+        """
+        Выдаёт свободное соединение-читатель из пула.
+        """
+        async with self._reader_slots:
+            connection = self._reader_pool.pop()
+            try:
+                yield connection
+            finally:
+                self._reader_pool.append(connection)
+
+    @asynccontextmanager
+    async def writer(self):
+        """
+        Эксклюзивный доступ к соединению-писателю; транзакция фиксируется при выходе.
+        """
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+    async def fetchall(self, sql: str, params: Iterable[Any] = ()) -> list[tuple]:
+        async with track_external("sqlite"), self.reader() as connection:
+            async with connection.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def fetchone(self, sql: str, params: Iterable[Any] = ()) -> tuple | None:
+        async with track_external("sqlite"), self.reader() as connection:
+            async with connection.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def execute(self, sql: str, params: Iterable[Any] = ()) -> int:
+        """
+        Ставит изменяющий запрос в очередь писателя и ждёт коммита его пакета.
+        :return: lastrowid для INSERT, иначе число изменённых строк
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((sql, params, future))
+        async with track_external("sqlite"):
+            return await future
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._write_queue.get()]
+            # Пока коммитится предыдущий пакет, новые изменения копятся в очереди;
+            # дополнительно ждём не дольше WRITE_BATCH_DELAY, если очередь пуста
+            deadline = loop.time() + WRITE_BATCH_DELAY
+            while len(batch) < WRITE_BATCH_SIZE:
+                if not self._write_queue.empty():
+                    batch.append(self._write_queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._write_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._commit_batch(batch)
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+
+    async def _commit_batch(self, batch: list[tuple[str, Iterable[Any], asyncio.Future]]):
+        results: list[tuple[asyncio.Future, Any, BaseException | None]] = []
+        try:
+            async with self.writer() as connection:
+                await connection.execute("BEGIN")
+                for sql, params, future in batch:
+                    # Точка сохранения на каждый запрос: ошибка одного не откатывает остальные
+                    await connection.execute("SAVEPOINT write_op")
+                    try:
+                        cursor = await connection.execute(sql, params)
+                    except Exception as e:
+                        await connection.execute("ROLLBACK TO write_op")
+                        results.append((future, None, e))
+                    else:
+                        is_insert = sql.lstrip().upper().startswith("INSERT")
+                        results.append((future, cursor.lastrowid if is_insert else cursor.rowcount, None))
+                    await connection.execute("RELEASE write_op")
+        except Exception as e:
+            # Коммит не удался — ни одно изменение пакета не сохранено
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
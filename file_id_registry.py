@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+import json
+import os
+
+REGISTRY_FILE = "file_ids.jsonl"
+
+
+class FileIdRegistry:
+    """
+    Реестр file_id, которые Telegram вернул после первой загрузки локального файла.
+    Ключ — путь к файлу и SHA-256 его содержимого, поэтому изменённый файл
+    будет загружен заново. Реестр хранится в JSONL-журнале и дописывается по одной строке.
+    Хэш считается в потоке (asyncio.to_thread) и кэшируется по (mtime, размер),
+    поэтому отправка файла не читает его целиком в event loop.
+    """
+
+    def __init__(self, registry_file: str = REGISTRY_FILE):
+        self.registry_file = registry_file
+        self._file_ids: dict[tuple[str, str], str] = {}
+        # путь -> (mtime, размер, sha256), чтобы не пересчитывать хэш при каждой отправке
+        self._hashes: dict[str, tuple[float, int, str]] = {}
+
+    def load(self):
+        if not os.path.exists(self.registry_file):
+            return
+        with open(self.registry_file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # недописанная строка после аварийного завершения
+                key = (record["path"], record["sha256"])
+                if record.get("file_id"):
+                    self._file_ids[key] = record["file_id"]
+                else:
+                    self._file_ids.pop(key, None)
+
+    def content_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        self._hashes[path] = (stat.st_mtime, stat.st_size, digest)
+        return digest
+
+    async def key(self, path: str) -> tuple[str, str]:
+        return os.path.normpath(path), await asyncio.to_thread(self.content_hash, path)
+
+    async def get(self, path: str) -> str | None:
+        """
+        Возвращает file_id для файла или None, если файл ещё не загружался.
+        """
+        return self._file_ids.get(await self.key(path))
+
+    async def set(self, path: str, file_id: str):
+        key = await self.key(path)
+        if self._file_ids.get(key) == file_id:
+            return
+        self._file_ids[key] = file_id
+        self._append(key, file_id)
+
+    async def forget(self, path: str):
+        """
+        Удаляет запись (например, если Telegram отклонил сохранённый file_id).
+        """
+        key = await self.key(path)
+        if self._file_ids.pop(key, None) is not None:
+            self._append(key, None)
+
+    def _append(self, key: tuple[str, str], file_id: str | None):
+        record = {"path": key[0], "sha256": key[1], "file_id": file_id}
+        with open(self.registry_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
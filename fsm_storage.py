@@ -0,0 +1,177 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Mapping
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from metrics import track_external
+
+# --- Настройки хранилища FSM ---
+FSM_DB_NAME = "fsm_storage.db"
+FSM_CACHE_SIZE = 10_000   # активных чатов в памяти
+FSM_FLUSH_DELAY = 0.2     # секунд между изменением и записью на диск
+
+
+class _Record:
+    __slots__ = ("state", "data", "loaded_at")
+
+    def __init__(self, state: str | None, data: dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.loaded_at = time.monotonic()
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в SQLite с горячим кэшем и отложенной записью.
+    Все set_state/set_data/update_data, сделанные за FSM_FLUSH_DELAY секунд,
+    записываются одним пакетным UPSERT в одной транзакции, поэтому обработчик,
+    который меняет и данные, и состояние, даёт одну запись, а не несколько.
+    При нескольких процессах чат должен обрабатываться одним процессом
+    (или задайте cache_ttl, чтобы чужие изменения подхватывались из базы).
+    """
+
+    def __init__(self, path: str = FSM_DB_NAME, cache_size: int = FSM_CACHE_SIZE,
+                 flush_delay: float = FSM_FLUSH_DELAY, cache_ttl: float | None = None,
+                 key_builder: KeyBuilder | None = None):
+        self.path = path
+        self.cache_size = cache_size
+        self.flush_delay = flush_delay
+        self.cache_ttl = cache_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._connection: aiosqlite.Connection | None = None
+        self._open_lock = asyncio.Lock()
+        self._cache: OrderedDict[str, _Record] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._flush_task: asyncio.Task | None = None
+
+    async def _db(self) -> aiosqlite.Connection:
+        if self._connection is None:
+            async with self._open_lock:
+                if self._connection is None:
+                    connection = await aiosqlite.connect(self.path)
+                    await connection.execute("PRAGMA journal_mode=WAL")
+                    await connection.execute("PRAGMA synchronous=NORMAL")
+                    await connection.execute('''
+                        CREATE TABLE IF NOT EXISTS fsm (
+                            key TEXT PRIMARY KEY,
+                            state TEXT,
+                            data TEXT NOT NULL
+                        )
+                    ''')
+                    await connection.commit()
+                    self._connection = connection
+        return self._connection
+
+    async def _record(self, key: StorageKey) -> tuple[str, _Record]:
+        storage_key = self.key_builder.build(key)
+        record = self._cache.get(storage_key)
+        if record is not None and (self.cache_ttl is None or storage_key in self._dirty
+                                   or time.monotonic() - record.loaded_at < self.cache_ttl):
+            self._cache.move_to_end(storage_key)
+            return storage_key, record
+
+        db = await self._db()
+        async with track_external("sqlite"):
+            async with db.execute("SELECT state, data FROM fsm WHERE key = ?", (storage_key,)) as cursor:
+                row = await cursor.fetchone()
+        record = _Record(row[0], json.loads(row[1])) if row else _Record(None, {})
+        self._cache[storage_key] = record
+        self._evict()
+        return storage_key, record
+
+    def _evict(self):
+        # Вытесняем только уже записанные на диск чаты
+        while len(self._cache) > self.cache_size:
+            for storage_key in self._cache:
+                if storage_key not in self._dirty:
+                    del self._cache[storage_key]
+                    break
+            else:
+                return
+
+    def _mark_dirty(self, storage_key: str):
+        self._dirty.add(storage_key)
+        if self._flush_handle is None and (self._flush_task is None or self._flush_task.done()):
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_delay, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """
+        Записывает все изменённые чаты одной транзакцией.
+        """
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        try:
+            upserts, deletes = [], []
+            for storage_key in list(dirty):
+                record = self._cache[storage_key]
+                if record.state is None and not record.data:
+                    deletes.append((storage_key,))
+                    continue
+                try:
+                    data = json.dumps(record.data, ensure_ascii=False)
+                except (TypeError, ValueError) as e:
+                    # Данные не сериализуются в JSON — повтор не поможет, остальные чаты записываем
+                    print(f"Состояние FSM {storage_key} не записано: {e}")
+                    dirty.discard(storage_key)
+                    continue
+                upserts.append((storage_key, record.state, data))
+            db = await self._db()
+            async with track_external("sqlite"):
+                if upserts:
+                    await db.executemany('''
+                        INSERT INTO fsm (key, state, data) VALUES (?, ?, ?)
+                        ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data
+                    ''', upserts)
+                if deletes:
+                    await db.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+                await db.commit()
+        except Exception as e:
+            print(f"Ошибка записи состояния FSM: {e}")
+            self._dirty |= dirty  # повторим при следующей записи
+        finally:
+            if self._dirty and self._flush_handle is None:
+                loop = asyncio.get_running_loop()
+                self._flush_handle = loop.call_later(self.flush_delay, self._start_flush)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key, record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(storage_key)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, record = await self._record(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        storage_key, record = await self._record(key)
+        record.data = data.copy()
+        self._mark_dirty(storage_key)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, record = await self._record(key)
+        return record.data.copy()
+
+    async def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
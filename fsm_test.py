@@ -1,25 +1,41 @@
 import asyncio
+import csv
+import json
+import os
+import tempfile
+import time
 from datetime import datetime
 
-import aiosqlite
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.filters import Command, CommandStart
 from aiogram.types import (
     Message,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
-    CallbackQuery
+    CallbackQuery,
+    FSInputFile
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from config import TG_TOKEN
+from webhook import run_bot
+from metrics import setup_metrics
+from update_scheduler import setup_update_scheduler
+from database import Database, casefold
+from fsm_storage import SQLiteStorage
+from student_cache import StudentCache
+from send_scheduler import MESSAGE_LIMIT, SendScheduler, bulk_sends
 
 # --- Настройка базы данных ---
 DB_NAME = "school_data.db"
+# Соединения открываются один раз в init_db и живут всё время работы бота
+database = Database()
+# Кэш поиска по ID и по классу; записи сбрасываются при изменениях
+student_cache = StudentCache(database)
 
 async def init_db():
-    async with aiosqlite.connect(DB_NAME) as db:
+    await database.open(DB_NAME)
+    async with database.writer() as db:
         await db.execute('''
             CREATE TABLE IF NOT EXISTS students (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -29,9 +45,176 @@ async def init_db():
                 data DATETIME NOT NULL
             )
         ''')
-        await db.commit()
+        await migrate_search_index(db)
+        await migrate_grade_stats(db)
         print("✅ Таблица students создана или уже существует.")
 
+async def migrate_search_index(db):
+    """
+    Индексы для поиска: нормализованный класс (grade_norm) и FTS5-индекс
+    триграмм по имени для поиска подстроки. Триггеры держат их в актуальном состоянии.
+    grade_norm бот записывает сам (casefold в Python): в триггерах только встроенные
+    функции SQLite, чтобы базу можно было менять и из sqlite3 CLI или скриптов.
+    """
+    cursor = await db.execute("PRAGMA table_info(students)")
+    columns = {row[1] for row in await cursor.fetchall()}
+    if "grade_norm" not in columns:
+        # Заполняем один раз, при добавлении столбца; дальше grade_norm пишет бот
+        await db.execute("ALTER TABLE students ADD COLUMN grade_norm TEXT")
+        await db.execute("UPDATE students SET grade_norm = casefold(grade)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_students_grade_norm ON students (grade_norm, name)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_students_name ON students (name, id)")
+
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students_fts'")
+    if await cursor.fetchone() is None:
+        await db.execute('''
+            CREATE VIRTUAL TABLE students_fts USING fts5(
+                name, content='students', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+        await db.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+
+    await db.executescript('''
+        CREATE TRIGGER IF NOT EXISTS students_search_ai AFTER INSERT ON students BEGIN
+            INSERT INTO students_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS students_search_ad AFTER DELETE ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS students_search_au_name AFTER UPDATE OF name ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+            INSERT INTO students_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END;
+        -- Запись без grade_norm (не из бота): встроенная lower() приводит к нижнему регистру только ASCII
+        CREATE TRIGGER IF NOT EXISTS students_grade_norm_ai AFTER INSERT ON students
+        WHEN NEW.grade_norm IS NULL BEGIN
+            UPDATE students SET grade_norm = lower(NEW.grade) WHERE id = NEW.id;
+        END;
+    ''')
+
+async def migrate_grade_stats(db):
+    """
+    Агрегаты по классам для /stats: число студентов и сумма возрастов.
+    Триггеры обновляют строку класса при каждом INSERT, DELETE и изменении
+    класса (grade_norm) или возраста, поэтому /stats читает готовую таблицу вместо GROUP BY по students.
+    """
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'grade_stats'")
+    if await cursor.fetchone() is None:
+        await db.execute('''
+            CREATE TABLE grade_stats (
+                grade_norm TEXT PRIMARY KEY,
+                grade TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                age_sum INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        await db.execute('''
+            INSERT INTO grade_stats (grade_norm, grade, count, age_sum)
+            SELECT grade_norm, MIN(grade), COUNT(*), SUM(age) FROM students
+            WHERE grade_norm IS NOT NULL GROUP BY grade_norm
+        ''')
+
+    # grade — написание класса, каким его впервые ввели; строки сопоставляются по grade_norm.
+    # Строка без grade_norm учитывается, когда его заполнит students_grade_norm_ai (это UPDATE)
+    await db.executescript('''
+        CREATE TRIGGER IF NOT EXISTS grade_stats_ai AFTER INSERT ON students WHEN NEW.grade_norm IS NOT NULL BEGIN
+            INSERT INTO grade_stats (grade_norm, grade, count, age_sum)
+            VALUES (NEW.grade_norm, NEW.grade, 1, NEW.age)
+            ON CONFLICT(grade_norm) DO UPDATE SET count = count + 1, age_sum = age_sum + excluded.age_sum;
+        END;
+        CREATE TRIGGER IF NOT EXISTS grade_stats_ad AFTER DELETE ON students BEGIN
+            UPDATE grade_stats SET count = count - 1, age_sum = age_sum - OLD.age
+            WHERE grade_norm = OLD.grade_norm;
+            DELETE FROM grade_stats WHERE grade_norm = OLD.grade_norm AND count <= 0;
+        END;
+        CREATE TRIGGER IF NOT EXISTS grade_stats_au AFTER UPDATE OF grade_norm, age ON students BEGIN
+            UPDATE grade_stats SET count = count - 1, age_sum = age_sum - OLD.age
+            WHERE grade_norm = OLD.grade_norm;
+            DELETE FROM grade_stats WHERE grade_norm = OLD.grade_norm AND count <= 0;
+            INSERT INTO grade_stats (grade_norm, grade, count, age_sum)
+            SELECT NEW.grade_norm, NEW.grade, 1, NEW.age WHERE NEW.grade_norm IS NOT NULL
+            ON CONFLICT(grade_norm) DO UPDATE SET count = count + 1, age_sum = age_sum + excluded.age_sum;
+        END;
+    ''')
+
+def name_filter(search: str) -> tuple[str, tuple]:
+    """
+    Условие WHERE для поиска по подстроке имени без учёта регистра.
+    Для запросов от 3 символов используется FTS5-индекс триграмм,
+    более короткие ищутся перебором (триграммам нужно минимум 3 символа).
+    """
+    if not search:
+        return "1", ()
+    if len(search) >= 3:
+        phrase = '"' + search.replace('"', '""') + '"'
+        return "id IN (SELECT rowid FROM students_fts WHERE students_fts MATCH ?)", (phrase,)
+    # Экранируем спецсимволы LIKE, чтобы «_» и «%» в запросе искались буквально
+    pattern = search.casefold().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return "casefold(name) LIKE ? ESCAPE '\\'", (f"%{pattern}%",)
+
+async def search_students_by_name(search: str, columns: str, limit: int | None = None) -> list[tuple]:
+    """
+    Поиск студентов по подстроке имени.
+    :param columns: список столбцов students для SELECT, например "id, name, age, grade"
+    """
+    where, params = name_filter(search)
+    limit_sql = f" LIMIT {int(limit)}" if limit else ""
+    return await database.fetchall(f"SELECT {columns} FROM students WHERE {where} ORDER BY name{limit_sql}", params)
+
+PAGE_SIZE = 10
+
+async def fetch_students_page(search: str, after: list | None = None, before: list | None = None):
+    """
+    Одна страница результатов поиска по имени (keyset-пагинация по (name, id)).
+    Читается только PAGE_SIZE + 1 строк, сколько бы студентов ни было в таблице.
+    :param after: (name, id) последней строки предыдущей страницы — листаем вперёд
+    :param before: (name, id) первой строки следующей страницы — листаем назад
+    :return: (строки, есть ли страница раньше, есть ли страница дальше)
+    """
+    where, params = name_filter(search)
+    columns = "id, name, age, grade, data"
+    if before:
+        rows = await database.fetchall(f'''
+            SELECT {columns} FROM students
+            WHERE {where} AND (name, id) < (?, ?)
+            ORDER BY name DESC, id DESC LIMIT ?
+        ''', (*params, *before, PAGE_SIZE + 1))
+        has_prev = len(rows) > PAGE_SIZE
+        return list(reversed(rows[:PAGE_SIZE])), has_prev, True
+
+    cursor_sql, cursor_params = ("AND (name, id) > (?, ?)", tuple(after)) if after else ("", ())
+    rows = await database.fetchall(f'''
+        SELECT {columns} FROM students
+        WHERE {where} {cursor_sql}
+        ORDER BY name, id LIMIT ?
+    ''', (*params, *cursor_params, PAGE_SIZE + 1))
+    return rows[:PAGE_SIZE], after is not None, len(rows) > PAGE_SIZE
+
+def students_page_keyboard(has_prev: bool, has_next: bool) -> InlineKeyboardMarkup | None:
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data="list_prev"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="Вперёд ➡️", callback_data="list_next"))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+async def show_students_page(state: FSMContext, search: str, after: list | None = None,
+                             before: list | None = None) -> tuple[str, InlineKeyboardMarkup | None]:
+    """
+    Загружает страницу, запоминает её границы в данных FSM и возвращает текст с кнопками.
+    """
+    rows, has_prev, has_next = await fetch_students_page(search, after=after, before=before)
+    if not rows:
+        return "❌ Нет студентов.", None
+
+    lines = ["📋 Найденные студенты:\n\n"]
+    for row in rows:
+        lines.append(f"🔹 ID: {row[0]} | {row[1]}, {row[2]} лет, {row[3]}\n📅 {row[4]}\n\n")
+    await state.update_data(list_query=search,
+                            list_first=[rows[0][1], rows[0][0]],
+                            list_last=[rows[-1][1], rows[-1][0]])
+    return "".join(lines), students_page_keyboard(has_prev, has_next)
+
 # --- Машины состояний ---
 class StudentForm(StatesGroup):
     waiting_for_name = State()
@@ -51,9 +234,16 @@ class DeleteStudentForm(StatesGroup):
     waiting_select = State()
     confirm_delete = State()
 
+class ImportForm(StatesGroup):
+    waiting_file = State()
+
 # --- Инициализация ---
 bot = Bot(token=TG_TOKEN)
-storage = MemoryStorage()
+# Очередь исходящих сообщений с лимитами Telegram (без 429 под нагрузкой)
+send_scheduler = SendScheduler()
+bot.session.middleware(send_scheduler)
+# Состояния диалогов переживают перезапуск; запись на диск идёт пакетами
+storage = SQLiteStorage("fsm_storage.db")
 dp = Dispatcher(storage=storage)
 router = Router()
 
@@ -65,6 +255,7 @@ def main_menu():
         [InlineKeyboardButton(text="🗑️ Удалить студента", callback_data="del")],
         [InlineKeyboardButton(text="🔍 Найти по имени", callback_data="find_by_name")],
         [InlineKeyboardButton(text="📚 Найти по классу", callback_data="find_by_grade")],
+        [InlineKeyboardButton(text="📊 Статистика по классам", callback_data="stats")],
         [InlineKeyboardButton(text="📋 Помощь", callback_data="help")],
     ])
 
@@ -79,6 +270,9 @@ async def cmd_help(message: Message):
         "/del — выбрать и удалить студента\n"
         "/find_by_name — найти студента по имени\n"
         "/find_by_grade — найти всех студентов по классу\n"
+        "/stats — число студентов и средний возраст по классам\n"
+        "/import — загрузить студентов из CSV или JSONL файла\n"
+        "/export — выгрузить всех студентов в CSV файл\n"
         "/help — показать это сообщение"
     )
     await message.answer(help_text, reply_markup=main_menu())
@@ -129,20 +323,21 @@ async def process_grade(message: Message, state: FSMContext):
     await state.update_data(grade=message.text)
     user_data = await state.get_data()
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''
-            INSERT INTO students (name, age, grade, data) 
-            VALUES (?, ?, ?, ?)
-        ''', (user_data['name'], user_data['age'], user_data['grade'], datetime.now()))
-        await db.commit()
+    await database.execute('''
+        INSERT INTO students (name, age, grade, grade_norm, data)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (user_data['name'], user_data['age'], user_data['grade'], casefold(user_data['grade']), datetime.now()))
+    student_cache.invalidate_insert(user_data['grade'])
 
+    # Подтверждение и меню — одним сообщением: вдвое меньше отправок в чат
     await message.answer(
         f"✅ Студент добавлен!\n"
         f"Имя: {user_data['name']}\n"
         f"Возраст: {user_data['age']}\n"
-        f"Класс: {user_data['grade']}"
+        f"Класс: {user_data['grade']}\n\n"
+        f"Выберите следующее действие:",
+        reply_markup=main_menu()
     )
-    await message.answer("Выберите следующее действие:", reply_markup=main_menu())
     await state.clear()
 
 # --- Найти по имени ---
@@ -160,31 +355,26 @@ async def find_by_name_cmd(call: CallbackQuery | Message, state: FSMContext):
 async def process_find_by_name(message: Message, state: FSMContext):
     search_name = message.text.strip()
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        if search_name:
-            cursor = await db.execute('''
-                SELECT id, name, age, grade, data FROM students 
-                WHERE LOWER(name) LIKE ? 
-                ORDER BY name
-            ''', (f'%{search_name.lower()}%',))
-        else:
-            cursor = await db.execute('''
-                SELECT id, name, age, grade, data FROM students 
-                ORDER BY name
-            ''')
+    # Состояние сбрасываем, но границы страницы остаются в данных для кнопок навигации
+    await state.clear()
+    result, keyboard = await show_students_page(state, search_name)
 
-        rows = await cursor.fetchall()
+    await message.answer(result, reply_markup=keyboard)
+    await message.answer("Выберите следующее действие:", reply_markup=main_menu())
 
-    if rows:
-        result = "📋 Найденные студенты:\n\n"
-        for row in rows:
-            result += f"🔹 ID: {row[0]} | {row[1]}, {row[2]} лет, {row[3]}\n📅 {row[4]}\n\n"
-    else:
-        result = "❌ Нет студентов."
+@router.callback_query(F.data.in_({"list_next", "list_prev"}))
+async def students_page_nav(call: CallbackQuery, state: FSMContext):
+    user_data = await state.get_data()
+    if "list_query" not in user_data:
+        await call.answer("Список устарел, выполните поиск заново.", show_alert=True)
+        return
 
-    await message.answer(result)
-    await message.answer("Выберите следующее действие:", reply_markup=main_menu())
-    await state.clear()
+    if call.data == "list_next":
+        result, keyboard = await show_students_page(state, user_data['list_query'], after=user_data['list_last'])
+    else:
+        result, keyboard = await show_students_page(state, user_data['list_query'], before=user_data['list_first'])
+    await call.message.edit_text(result, reply_markup=keyboard)
+    await call.answer()
 
 # --- Найти по классу ---
 @router.message(Command('find_by_grade'))
@@ -201,13 +391,7 @@ async def find_by_grade_cmd(call: CallbackQuery | Message, state: FSMContext):
 async def process_find_by_grade(message: Message, state: FSMContext):
     grade = message.text.strip()
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute('''
-            SELECT id, name, age, grade, data FROM students 
-            WHERE LOWER(grade) = ? 
-            ORDER BY name
-        ''', (grade.lower(),))
-        rows = await cursor.fetchall()
+    rows = await student_cache.get_grade(grade)
 
     if rows:
         result = f"📋 Студенты класса {grade}:\n\n"
@@ -220,6 +404,50 @@ async def process_find_by_grade(message: Message, state: FSMContext):
     await message.answer("Выберите следующее действие:", reply_markup=main_menu())
     await state.clear()
 
+# --- Статистика по классам ---
+def utf16_len(text: str) -> int:
+    # Telegram считает длину сообщения в UTF-16: эмодзи занимают две единицы
+    return len(text.encode("utf-16-le")) // 2
+
+def split_message(lines: list[str], limit: int = MESSAGE_LIMIT) -> list[str]:
+    """
+    Склеивает строки в сообщения не длиннее limit (слишком длинная строка обрезается).
+    """
+    chunks, current = [], ""
+    for line in lines:
+        while utf16_len(line) > limit:
+            line = line[:-(utf16_len(line) - limit)]
+        if current and utf16_len(current) + utf16_len(line) > limit:
+            chunks.append(current)
+            current = ""
+        current += line
+    if current:
+        chunks.append(current)
+    return chunks
+
+@router.message(Command('stats'))
+@router.callback_query(F.data == "stats")
+async def cmd_stats(event: Message | CallbackQuery, state: FSMContext):
+    # Одно чтение готовых агрегатов (их ведут триггеры), без GROUP BY по всей таблице
+    rows = await database.fetchall("SELECT grade, count, age_sum FROM grade_stats ORDER BY grade_norm")
+
+    if rows:
+        total = sum(row[1] for row in rows)
+        lines = [f"📊 Статистика по классам (всего студентов: {total}):\n\n"]
+        for grade, count, age_sum in rows:
+            lines.append(f"🏫 {grade}: {count} чел., средний возраст {age_sum / count:.1f}\n")
+    else:
+        lines = ["❌ В базе пока нет студентов."]
+
+    message = event.message if isinstance(event, CallbackQuery) else event
+    # Классов может быть сколько угодно, а сообщение Telegram ограничено MESSAGE_LIMIT символами
+    for chunk in split_message(lines):
+        await message.answer(chunk)
+    await message.answer("Выберите следующее действие:", reply_markup=main_menu())
+    if isinstance(event, CallbackQuery):
+        await event.answer()
+    await state.clear()
+
 # --- Изменить студента ---
 @router.message(Command('edit'))
 @router.callback_query(F.data == "edit")
@@ -235,16 +463,11 @@ async def edit_student_start(call: CallbackQuery | Message, state: FSMContext):
 @router.message(EditStudentForm.waiting_select, F.text)
 async def edit_select_student(message: Message, state: FSMContext):
     search = message.text.strip()
-    async with aiosqlite.connect(DB_NAME) as db:
-        if search.isdigit():
-            cursor = await db.execute('SELECT id, name, age, grade FROM students WHERE id = ?', (int(search),))
-        else:
-            cursor = await db.execute('''
-                SELECT id, name, age, grade FROM students 
-                WHERE LOWER(name) LIKE ? 
-                ORDER BY name LIMIT 5
-            ''', (f'%{search.lower()}%',))
-        rows = await cursor.fetchall()
+    if search.isdigit():
+        student = await student_cache.get_student(int(search))
+        rows = [student] if student else []
+    else:
+        rows = await search_students_by_name(search, "id, name, age, grade", limit=5)
 
     if not rows:
         await message.answer("❌ Студент не найден.")
@@ -304,10 +527,16 @@ async def edit_set_value(message: Message, state: FSMContext):
             raise ValueError("не число")
         value = cast(new_value)
 
-        async with aiosqlite.connect(DB_NAME) as db:
-            await db.execute(f'UPDATE students SET {db_field} = ?, data = ? WHERE id = ?',
-                             (value, datetime.now(), student_id))
-            await db.commit()
+        old_student = await student_cache.get_student(student_id)
+        if db_field == "grade":
+            # grade_norm пишем вместе с классом — по нему ищет /find и считает /stats
+            await database.execute('UPDATE students SET grade = ?, grade_norm = ?, data = ? WHERE id = ?',
+                                   (value, casefold(value), datetime.now(), student_id))
+        else:
+            await database.execute(f'UPDATE students SET {db_field} = ?, data = ? WHERE id = ?',
+                                   (value, datetime.now(), student_id))
+        student_cache.invalidate_student(student_id, old_student[3] if old_student else None,
+                                         value if db_field == "grade" else None)
 
         await message.answer(f"✅ Поле '{field}' успешно обновлено на '{new_value}'")
     except Exception:
@@ -337,16 +566,11 @@ async def delete_student_start(call: CallbackQuery | Message, state: FSMContext)
 @router.message(DeleteStudentForm.waiting_select, F.text)
 async def delete_select_student(message: Message, state: FSMContext):
     search = message.text.strip()
-    async with aiosqlite.connect(DB_NAME) as db:
-        if search.isdigit():
-            cursor = await db.execute('SELECT id, name, age, grade FROM students WHERE id = ?', (int(search),))
-        else:
-            cursor = await db.execute('''
-                SELECT id, name, age, grade FROM students 
-                WHERE LOWER(name) LIKE ? 
-                ORDER BY name LIMIT 5
-            ''', (f'%{search.lower()}%',))
-        rows = await cursor.fetchall()
+    if search.isdigit():
+        student = await student_cache.get_student(int(search))
+        rows = [student] if student else []
+    else:
+        rows = await search_students_by_name(search, "id, name, age, grade", limit=5)
 
     if not rows:
         await message.answer("❌ Студент не найден.")
@@ -376,9 +600,9 @@ async def confirm_delete(call: CallbackQuery, state: FSMContext):
     user_data = await state.get_data()
     student_id = user_data['delete_student_id']
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('DELETE FROM students WHERE id = ?', (student_id,))
-        await db.commit()
+    old_student = await student_cache.get_student(student_id)
+    await database.execute('DELETE FROM students WHERE id = ?', (student_id,))
+    student_cache.invalidate_student(student_id, old_student[3] if old_student else None)
 
     await call.message.answer("✅ Студент удалён.")
     await call.message.answer("Выберите действие:", reply_markup=main_menu())
@@ -392,6 +616,127 @@ async def cancel_delete(call: CallbackQuery, state: FSMContext):
     await state.clear()
     await call.answer()
 
+# --- Массовый импорт и экспорт ---
+IMPORT_CHUNK_SIZE = 1000       # строк в одной транзакции
+PROGRESS_INTERVAL = 2.0        # секунд между обновлениями сообщения о прогрессе
+INSERT_STUDENT_SQL = 'INSERT INTO students (name, age, grade, grade_norm, data) VALUES (?, ?, ?, ?, ?)'
+
+def iter_import_rows(path: str, file_name: str):
+    """
+    Построчно читает CSV (с заголовком name,age,grade) или JSONL ({"name", "age", "grade"}).
+    Возвращает кортежи для INSERT или None для некорректных строк.
+    """
+    is_jsonl = file_name.lower().endswith((".jsonl", ".json", ".ndjson"))
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        records = f if is_jsonl else csv.DictReader(f)
+        now = datetime.now()
+        for record in records:
+            try:
+                if is_jsonl:
+                    if not record.strip():
+                        continue
+                    record = json.loads(record)
+                name = str(record["name"]).strip()
+                grade = str(record["grade"]).strip()
+                age = int(record["age"])
+                if not name or not grade or age < 0:
+                    raise ValueError
+            except (TypeError, KeyError, ValueError, AttributeError):
+                yield None
+                continue
+            yield name, age, grade, casefold(grade), now
+
+def read_chunk(rows, size: int) -> list:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            break
+    return chunk
+
+@router.message(Command('import'))
+async def cmd_import(message: Message, state: FSMContext):
+    await message.answer(
+        "Отправьте файл CSV (заголовок: name,age,grade) или JSONL "
+        "(в каждой строке {\"name\": ..., \"age\": ..., \"grade\": ...})."
+    )
+    await state.set_state(ImportForm.waiting_file)
+
+@router.message(ImportForm.waiting_file, F.document)
+async def process_import_file(message: Message, state: FSMContext):
+    await state.clear()
+    document = message.document
+    progress = await message.answer("⏳ Загружаю файл...")
+
+    fd, path = tempfile.mkstemp(suffix=".import")
+    os.close(fd)
+    imported = skipped = 0
+    try:
+        # Файл скачивается потоково на диск и читается порциями, целиком в память не попадает
+        await message.bot.download(document, destination=path)
+        rows = iter_import_rows(path, document.file_name or "")
+        last_progress = time.monotonic()
+        while True:
+            chunk = await asyncio.to_thread(read_chunk, rows, IMPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            valid = [row for row in chunk if row is not None]
+            skipped += len(chunk) - len(valid)
+            if valid:
+                # Одна транзакция и один executemany на порцию вместо INSERT+commit на студента
+                async with database.writer() as db:
+                    await db.executemany(INSERT_STUDENT_SQL, valid)
+                student_cache.invalidate_insert(*{row[2] for row in valid})
+                imported += len(valid)
+            if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                # Прогресс уступает очередь ответам другим пользователям
+                with bulk_sends():
+                    await progress.edit_text(f"⏳ Импортировано: {imported}, пропущено: {skipped}...")
+        await progress.edit_text(f"✅ Импорт завершён. Добавлено: {imported}, пропущено строк: {skipped}.")
+    except Exception as e:
+        await progress.edit_text(f"❌ Ошибка импорта после {imported} строк: {e}")
+    finally:
+        os.remove(path)
+    await message.answer("Выберите следующее действие:", reply_markup=main_menu())
+
+@router.message(ImportForm.waiting_file)
+async def process_import_not_file(message: Message):
+    await message.answer("Пришлите файл документом (CSV или JSONL).")
+
+async def export_students_csv(path: str) -> int:
+    """
+    Выгружает таблицу students в CSV порциями через курсор, не загружая её в память.
+    :return: число выгруженных строк
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "name", "age", "grade", "data"])
+        async with database.reader() as db:
+            async with db.execute('SELECT id, name, age, grade, data FROM students ORDER BY id') as cursor:
+                while rows := await cursor.fetchmany(IMPORT_CHUNK_SIZE):
+                    writer.writerows(rows)
+                    count += len(rows)
+    return count
+
+@router.message(Command('export'))
+async def cmd_export(message: Message):
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        count = await export_students_csv(path)
+        # Выгрузка — массовая отправка: ответы другим пользователям идут раньше неё
+        with bulk_sends():
+            await message.answer_document(
+                FSInputFile(path, filename=f"students_{datetime.now():%Y%m%d_%H%M%S}.csv"),
+                caption=f"📤 Выгружено студентов: {count}"
+            )
+    except Exception as e:
+        await message.answer(f"❌ Ошибка экспорта: {e}")
+    finally:
+        os.remove(path)
+
 # --- Обработчик всех callback-кнопок ---
 @router.callback_query(F.data == "help")
 async def callback_help(call: CallbackQuery):
@@ -403,6 +748,9 @@ async def callback_help(call: CallbackQuery):
         "/del — выбрать и удалить студента\n"
         "/find_by_name — найти студента по имени\n"
         "/find_by_grade — найти всех студентов по классу\n"
+        "/stats — число студентов и средний возраст по классам\n"
+        "/import — загрузить студентов из CSV или JSONL файла\n"
+        "/export — выгрузить всех студентов в CSV файл\n"
         "/help — показать это сообщение"
     )
     await call.message.answer(help_text, reply_markup=main_menu())
@@ -413,7 +761,16 @@ dp.include_router(router)
 
 async def main():
     await init_db()
-    await dp.start_polling(bot)
+    setup_metrics(dp)
+    update_scheduler = setup_update_scheduler(dp)  # чаты параллельно, внутри чата — по порядку
+    # Остановка по порядку регистрации: сначала дорабатывает очередь обновлений,
+    # затем закрывается то, чем пользуются обработчики. Хранилище FSM Dispatcher
+    # закрывает первым, а обработчики из очереди открывают его заново — закрываем ещё раз
+    dp.shutdown.register(update_scheduler.close)
+    dp.shutdown.register(dp.storage.close)
+    dp.shutdown.register(send_scheduler.close)
+    dp.shutdown.register(database.close)
+    await run_bot(dp, bot)  # polling или вебхук (BOT_MODE)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,27 @@
+import httpx
+
+# Общий асинхронный HTTP-клиент для внешних API (пул соединений + keep-alive)
+HTTP_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Возвращает общий клиент, создавая его при первом обращении.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+    return _client
+
+
+async def close_http_client():
+    """
+    Закрывает общий клиент (вызывается при остановке бота).
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,212 @@
+import asyncio
+import csv
+import ipaddress
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import suppress
+from typing import Awaitable, Callable, Iterator
+
+# --- Настройки массового определения городов ---
+BULK_CONCURRENCY = 8           # одновременных определений города (лимит клиента DaData — 10)
+BULK_CHUNK_SIZE = 5000         # IP за одно обращение к временной базе
+BULK_PROGRESS_INTERVAL = 2.0   # секунд между обновлениями сообщения о прогрессе
+
+_IPV4_RE = re.compile(r"(?<![\d.])(?:\d{1,3}\.){3}\d{1,3}(?![\d.])")
+_IPV6_RE = re.compile(r"(?<![\w:])(?:[0-9A-Fa-f]{0,4}:){2,7}[0-9A-Fa-f]{0,4}(?![\w:.])")
+
+
+def extract_ips(line: str) -> Iterator[str]:
+    """
+    IP-адреса из строки лога, CSV или простого списка (некорректные пропускаются).
+    """
+    for pattern in (_IPV4_RE, _IPV6_RE):
+        for candidate in pattern.findall(line):
+            try:
+                yield str(ipaddress.ip_address(candidate))
+            except ValueError:
+                continue
+
+
+def iter_file_ips(path: str) -> Iterator[str]:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            yield from extract_ips(line)
+
+
+def read_chunk(items: Iterator, size: int) -> list:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            break
+    return chunk
+
+
+class IpBulkStore:
+    """
+    Временная SQLite-база на диске: уникальные IP в порядке первого появления,
+    число повторов и результат. Сколько бы строк ни было в файле, в памяти
+    держится только текущая порция.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Обращения идут из потоков asyncio.to_thread (чтение порций и запись результатов
+        # могут совпасть по времени), поэтому соединение защищено блокировкой
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=OFF")
+        self._connection.execute("PRAGMA synchronous=OFF")
+        self._connection.execute('''
+            CREATE TABLE ips (
+                id INTEGER PRIMARY KEY,
+                ip TEXT NOT NULL UNIQUE,
+                hits INTEGER NOT NULL DEFAULT 1,
+                city TEXT,
+                error TEXT
+            )
+        ''')
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def add(self, ips: list[str]):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT INTO ips (ip) VALUES (?) ON CONFLICT(ip) DO UPDATE SET hits = hits + 1",
+                ((ip,) for ip in ips),
+            )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM ips").fetchone()[0]
+
+    def page(self, after_id: int, size: int) -> list[tuple[int, str]]:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT id, ip FROM ips WHERE id > ? ORDER BY id LIMIT ?", (after_id, size)
+            ).fetchall()
+
+    def save(self, results: list[tuple[str | None, str | None, int]]):
+        """
+        :param results: (город, ошибка, id)
+        """
+        with self._lock, self._connection:
+            self._connection.executemany("UPDATE ips SET city = ?, error = ? WHERE id = ?", results)
+
+    def export_csv(self, path: str) -> tuple[int, int]:
+        """
+        :return: (всего уникальных IP, из них с найденным городом)
+        """
+        total = found = 0
+        with self._lock, open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["ip", "hits", "city", "error"])
+            cursor = self._connection.execute("SELECT ip, hits, city, error FROM ips ORDER BY id")
+            while rows := cursor.fetchmany(BULK_CHUNK_SIZE):
+                writer.writerows(rows)
+                total += len(rows)
+                found += sum(1 for row in rows if row[2])
+        return total, found
+
+
+async def geolocate_file(source_path: str, result_path: str, resolve: Callable[[str], Awaitable[str | None]],
+                         on_progress: Callable[[str], Awaitable[None]] | None = None,
+                         concurrency: int = BULK_CONCURRENCY,
+                         is_fatal: Callable[[Exception], bool] | None = None) -> tuple[int, int]:
+    """
+    Определяет города для всех IP из файла и сохраняет результат в CSV (ip, hits, city, error).
+    Файл читается порциями, повторы схлопываются во временной базе, города определяются
+    не больше чем concurrency запросами одновременно.
+    :param resolve: определение города по IP (кэш → база диапазонов → DaData)
+    :param on_progress: вызывается не чаще BULK_PROGRESS_INTERVAL с текстом о ходе работы
+    :param is_fatal: какие ошибки resolve прерывают всю обработку (например, неверный токен);
+        остальные записываются в столбец error, и обработка продолжается
+    :return: (уникальных IP, из них с найденным городом)
+    """
+    store_path = f"{result_path}.sqlite"
+    store = await asyncio.to_thread(IpBulkStore, store_path)
+    last_progress = time.monotonic()
+
+    async def report(text: str, force: bool = False):
+        nonlocal last_progress
+        if on_progress is not None and (force or time.monotonic() - last_progress >= BULK_PROGRESS_INTERVAL):
+            last_progress = time.monotonic()
+            await on_progress(text)
+
+    try:
+        ips = iter_file_ips(source_path)
+        scanned = 0
+        while chunk := await asyncio.to_thread(read_chunk, ips, BULK_CHUNK_SIZE):
+            await asyncio.to_thread(store.add, chunk)
+            scanned += len(chunk)
+            await report(f"⏳ Читаю файл: найдено IP {scanned}...")
+        total = await asyncio.to_thread(store.count)
+        await report(f"⏳ Уникальных IP: {total} (всего в файле {scanned}). Определяю города...", force=True)
+
+        # Очередь ограничена, поэтому в памяти одновременно не больше пары порций IP
+        queue: asyncio.Queue[tuple[int, str] | None] = asyncio.Queue(maxsize=concurrency * 2)
+        results: list[tuple[str | None, str | None, int]] = []
+        resolved = 0
+
+        async def produce():
+            after_id = 0
+            while page := await asyncio.to_thread(store.page, after_id, BULK_CHUNK_SIZE):
+                for item in page:
+                    await queue.put(item)
+                after_id = page[-1][0]
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        async def work():
+            nonlocal resolved
+            while (item := await queue.get()) is not None:
+                row_id, ip = item
+                try:
+                    results.append((await resolve(ip), None, row_id))
+                except Exception as e:
+                    if is_fatal is not None and is_fatal(e):
+                        raise
+                    results.append((None, str(e) or type(e).__name__, row_id))
+                resolved += 1
+
+        async def flush():
+            nonlocal results
+            if results:
+                batch, results = results, []
+                await asyncio.to_thread(store.save, batch)
+
+        stop_monitor = asyncio.Event()
+
+        async def monitor():
+            # Останавливается по флагу, а не отменой: отмена не прерывает store.save в потоке,
+            # и запись пересеклась бы с итоговым flush и export_csv
+            while not stop_monitor.is_set():
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(stop_monitor.wait(), BULK_PROGRESS_INTERVAL / 4)
+                if len(results) >= BULK_CHUNK_SIZE:
+                    await flush()
+                if not stop_monitor.is_set():
+                    await report(f"⏳ Определено городов: {resolved} из {total}...")
+
+        tasks = [asyncio.create_task(produce()), *(asyncio.create_task(work()) for _ in range(concurrency))]
+        monitor_task = asyncio.create_task(monitor())
+        try:
+            # Фатальная ошибка одного обработчика останавливает остальных и читателя очереди
+            finished, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in finished:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            stop_monitor.set()
+            await asyncio.gather(*tasks, monitor_task, return_exceptions=True)
+        await flush()
+        return await asyncio.to_thread(store.export_csv, result_path)
+    finally:
+        await asyncio.to_thread(store.close)
+        os.remove(store_path)
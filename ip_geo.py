@@ -0,0 +1,262 @@
+import argparse
+import csv
+import ipaddress
+import mmap
+import os
+import struct
+import sys
+from bisect import bisect_right
+from typing import Awaitable, Callable, Iterable
+
+from aio_utils import LRUCache, SingleFlight
+from metrics import Counter, REGISTRY
+
+# --- Настройки геолокации по IP (переменные окружения) ---
+# Локальная база диапазонов; если файла нет, работаем только с кэшем и DaData
+IP_GEO_DB = os.getenv("IP_GEO_DB", "ip_ranges.db")
+IP_CACHE_SIZE = 50_000      # записей в кэше (отдельно для адресов и для подсетей)
+IP_CACHE_TTL = 24 * 3600    # секунд: город провайдера меняется редко
+IP_NEGATIVE_TTL = 600       # секунд помним, что город для адреса не найден
+IPV4_PREFIX = 24            # подсеть, ответ для которой переиспользуется
+IPV6_PREFIX = 48
+
+IP_GEO_LOOKUPS = Counter("bot_ip_geo_lookups_total", "Определения города по IP по источнику ответа", ("source",))
+REGISTRY.append(IP_GEO_LOOKUPS)
+
+# --- Формат базы диапазонов ---
+# Заголовок, затем отсортированные по началу диапазоны IPv4 (start, end, город — uint32),
+# диапазоны IPv6 (start, end — 16 байт big-endian, город — uint32),
+# смещения названий городов (uint32) и сами названия в UTF-8.
+# Файл отображается в память, поиск — бинарный, без загрузки таблицы в Python-объекты.
+DB_MAGIC = b"AIGIPDB1"
+HEADER = struct.Struct("<8sIII")
+V4_RECORD = struct.Struct("<III")
+V6_RECORD = struct.Struct("<16s16sI")
+OFFSET = struct.Struct("<I")
+
+_MISSING = object()
+
+
+class _Starts:
+    """
+    Последовательность начал диапазонов поверх mmap — для bisect.
+    """
+
+    def __init__(self, buffer: mmap.mmap, base: int, count: int, record: struct.Struct):
+        self.buffer, self.base, self.count, self.record = buffer, base, count, record
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int):
+        return self.record.unpack_from(self.buffer, self.base + index * self.record.size)[0]
+
+
+class IpRangeDB:
+    """
+    Локальная база «диапазон IP → город» в файле, отображённом в память.
+    Поиск — бинарный по началам диапазонов, O(log n) на запрос.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, v4_count, v6_count, city_count = HEADER.unpack_from(self._buffer, 0)
+        if magic != DB_MAGIC:
+            self._buffer.close()
+            raise ValueError(f"{path}: не база диапазонов IP")
+        v4_base = HEADER.size
+        v6_base = v4_base + v4_count * V4_RECORD.size
+        self._offsets_base = v6_base + v6_count * V6_RECORD.size
+        self._names_base = self._offsets_base + (city_count + 1) * OFFSET.size
+        self._v4 = _Starts(self._buffer, v4_base, v4_count, V4_RECORD)
+        self._v6 = _Starts(self._buffer, v6_base, v6_count, V6_RECORD)
+
+    def __len__(self) -> int:
+        return len(self._v4) + len(self._v6)
+
+    def close(self):
+        self._buffer.close()
+
+    def lookup(self, ip: ipaddress.IPv4Address | ipaddress.IPv6Address) -> str | None:
+        if ip.version == 4:
+            starts, key = self._v4, int(ip)
+        else:
+            starts, key = self._v6, ip.packed
+        index = bisect_right(starts, key) - 1
+        if index < 0:
+            return None
+        _, end, city_id = starts.record.unpack_from(self._buffer, starts.base + index * starts.record.size)
+        if key > end:
+            return None
+        return self._city(city_id)
+
+    def _city(self, city_id: int) -> str:
+        start, end = struct.unpack_from("<II", self._buffer, self._offsets_base + city_id * OFFSET.size)
+        return self._buffer[self._names_base + start:self._names_base + end].decode("utf-8")
+
+
+def build_range_db(ranges: Iterable[tuple[str, str, str]], path: str) -> tuple[int, int]:
+    """
+    Собирает файл базы из диапазонов (начальный IP, конечный IP, город).
+    Пересекающиеся с предыдущими диапазоны пропускаются.
+    :return: (записано диапазонов, пропущено строк)
+    """
+    v4, v6 = [], []
+    cities: dict[str, int] = {}
+    skipped = 0
+    for start_text, end_text, city in ranges:
+        city = city.strip()
+        try:
+            start, end = ipaddress.ip_address(start_text.strip()), ipaddress.ip_address(end_text.strip())
+        except ValueError:
+            skipped += 1
+            continue
+        if not city or start.version != end.version or start > end:
+            skipped += 1
+            continue
+        city_id = cities.setdefault(city, len(cities))
+        (v4 if start.version == 4 else v6).append((int(start), int(end), city_id))
+
+    records = []
+    for items in (v4, v6):
+        items.sort()
+        kept = []
+        for item in items:
+            if kept and item[0] <= kept[-1][1]:
+                skipped += 1
+                continue
+            kept.append(item)
+        records.append(kept)
+    v4, v6 = records
+
+    names = [name.encode("utf-8") for name in cities]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(DB_MAGIC, len(v4), len(v6), len(names)))
+        for start, end, city_id in v4:
+            f.write(V4_RECORD.pack(start, end, city_id))
+        for start, end, city_id in v6:
+            f.write(V6_RECORD.pack(start.to_bytes(16, "big"), end.to_bytes(16, "big"), city_id))
+        offset = 0
+        for name in names:
+            f.write(OFFSET.pack(offset))
+            offset += len(name)
+        f.write(OFFSET.pack(offset))
+        for name in names:
+            f.write(name)
+    os.replace(tmp_path, path)
+    return len(v4) + len(v6), skipped
+
+
+class IpGeoResolver:
+    """
+    Город по IP: кэш (точный адрес, затем подсеть /24 или /48) → локальная база диапазонов → DaData.
+    Ответы DaData кладутся в кэш и для адреса, и для его подсети, поэтому соседние адреса
+    того же провайдера определяются без платного запроса. Одновременные запросы
+    одного адреса объединяются в один вызов DaData.
+    """
+
+    def __init__(self, remote: Callable[[str], Awaitable[str | None]], db_path: str | None = IP_GEO_DB,
+                 cache_size: int = IP_CACHE_SIZE, ttl: float = IP_CACHE_TTL, negative_ttl: float = IP_NEGATIVE_TTL):
+        """
+        :param remote: запрос города во внешнем сервисе (None — город не найден)
+        :param db_path: файл базы диапазонов (необязательный)
+        """
+        self.remote = remote
+        self.db_path = db_path
+        self.db: IpRangeDB | None = None
+        self._opened = False
+        self._by_ip = LRUCache(cache_size, ttl=ttl)
+        self._by_prefix = LRUCache(cache_size, ttl=ttl)
+        self._not_found = LRUCache(cache_size, ttl=negative_ttl)
+        self._flight = SingleFlight()
+
+    async def open(self):
+        """
+        Открывает локальную базу, если файл есть (вызывается при запуске бота).
+        """
+        self._opened = True
+        if self.db is None and self.db_path and os.path.exists(self.db_path):
+            try:
+                self.db = IpRangeDB(self.db_path)
+                print(f"База диапазонов IP загружена: {self.db_path} ({len(self.db)} диапазонов)")
+            except (OSError, ValueError) as e:
+                print(f"Не удалось открыть базу диапазонов IP: {e}")
+
+    async def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        self._opened = False
+
+    @staticmethod
+    def _prefix(ip: ipaddress.IPv4Address | ipaddress.IPv6Address) -> tuple[int, int]:
+        bits = 32 - IPV4_PREFIX if ip.version == 4 else 128 - IPV6_PREFIX
+        return ip.version, int(ip) >> bits
+
+    async def resolve(self, ip_text: str) -> str | None:
+        """
+        :return: город или None, если его не удалось определить
+        :raises ValueError: строка не является IP-адресом
+        """
+        ip = ipaddress.ip_address(ip_text.strip())
+        if not self._opened:
+            await self.open()
+
+        city = self._by_ip.get(ip, _MISSING)
+        if city is not _MISSING:
+            IP_GEO_LOOKUPS.inc("cache_ip")
+            return city
+        prefix = self._prefix(ip)
+        city = self._by_prefix.get(prefix, _MISSING)
+        if city is not _MISSING:
+            IP_GEO_LOOKUPS.inc("cache_prefix")
+            return city
+        if self.db is not None:
+            city = self.db.lookup(ip)
+            if city is not None:
+                IP_GEO_LOOKUPS.inc("db")
+                return city
+        if self._not_found.get(ip, _MISSING) is not _MISSING:
+            IP_GEO_LOOKUPS.inc("cache_miss")
+            return None
+
+        city = await self._flight.do(ip, lambda: self.remote(str(ip)))
+        IP_GEO_LOOKUPS.inc("remote")
+        if city is None:
+            self._not_found.set(ip, True)
+        else:
+            self._by_ip.set(ip, city)
+            self._by_prefix.set(prefix, city)
+        return city
+
+
+def _read_csv_ranges(path: str, city_column: int) -> Iterable[tuple[str, str, str]]:
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if len(row) > city_column:
+                yield row[0], row[1], row[city_column]
+
+
+if __name__ == "__main__":
+    # Пример: python ip_geo.py dbip-city-lite.csv --city-column 5
+    #         python ip_geo.py --lookup 77.88.55.1
+    parser = argparse.ArgumentParser(description="Сборка и проверка локальной базы диапазонов IP → город")
+    parser.add_argument("csv", nargs="?", help="CSV: начальный IP, конечный IP, …, город")
+    parser.add_argument("--city-column", type=int, default=2, help="номер столбца с городом (с нуля)")
+    parser.add_argument("--out", default=IP_GEO_DB, help="файл базы")
+    parser.add_argument("--lookup", nargs="*", default=[], help="IP-адреса для проверки по базе")
+    args = parser.parse_args()
+
+    if args.csv:
+        written, skipped_rows = build_range_db(_read_csv_ranges(args.csv, args.city_column), args.out)
+        print(f"{args.out}: записано диапазонов {written}, пропущено строк {skipped_rows}")
+    if args.lookup:
+        range_db = IpRangeDB(args.out)
+        for address in args.lookup:
+            print(address, range_db.lookup(ipaddress.ip_address(address)))
+        range_db.close()
+    if not args.csv and not args.lookup:
+        parser.print_help(sys.stderr)
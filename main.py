@@ -1,15 +1,24 @@
 import asyncio
 import random
-import requests #Для выполнения HTTP-запросов к внешним API
 import os
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import CommandStart, Command
-from aiogram.types import Message,FSInputFile
-from config import TG_TOKEN, OPENWEATHER_API_KEY
-from gtts import gTTS
-from googletrans import Translator
-from gtts import gTTS
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, FSInputFile, BufferedInputFile
+from config import TG_TOKEN
+from http_client import close_http_client
+from tts_cache import TTSCache
+from translation_service import TranslationService
+from photo_index import PhotoIndex
+from photo_ingest import PhotoIngestQueue
+from file_id_registry import FileIdRegistry
+from webhook import run_bot
+from metrics import setup_metrics
+from update_scheduler import setup_update_scheduler
+from send_scheduler import CAPTION_LIMIT, SendScheduler
+from weather_service import fetch_weather
+from resilience import UpstreamUnavailable
 
 
 # Напишите код для сохранения всех фото, которые отправляет пользователь боту в папке img
@@ -18,9 +27,24 @@ from gtts import gTTS
 
 bot = Bot(token=TG_TOKEN)
 dp = Dispatcher()
+# Очередь исходящих сообщений с лимитами Telegram (без 429 под нагрузкой)
+send_scheduler = SendScheduler()
+bot.session.middleware(send_scheduler)
 #Путь к папке для сохранения фото
 PHOTO_DIR = "img"
 os.makedirs(PHOTO_DIR, exist_ok=True)  # Создаём папку, если её нет
+# Индекс фото: папка сканируется только если индекса ещё нет на диске
+photo_index = PhotoIndex(PHOTO_DIR)
+photo_index.load()
+# Фоновая очередь скачивания фото (дедупликация и хранение по содержимому)
+photo_ingest = PhotoIngestQueue(bot, PHOTO_DIR, photo_index)
+# Реестр file_id: каждый локальный файл загружается в Telegram только один раз
+file_ids = FileIdRegistry()
+file_ids.load()
+# Кэш озвучки: повторные фразы не синтезируются заново
+tts_cache = TTSCache()
+# Общий переводчик с кэшем; одинаковые одновременные запросы объединяются
+translator = TranslationService()
 
 @dp.message(CommandStart())
 async def start(message: Message):
@@ -40,11 +64,10 @@ async def help(message: Message):
 @dp.message(Command('weather'))
 async def weather(message: Message):
     city = 'Moscow'
-    url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHER_API_KEY}&units=metric&lang=ru"
     try:
-        response = requests.get(url)  # Отправка запроса
-        data = response.json()  # Парсинг ответа в словарь
-        if response.status_code == 200:  # Проверка на успешность запроса
+        # Асинхронный запрос через общий клиент (не блокирует остальные чаты)
+        status_code, data = await fetch_weather(city)
+        if status_code == 200:  # Проверка на успешность запроса
             weather_info = (
                 f" Погода в г.{city}:\n"
                 f" Температура:  {data['main']['temp']} °C\n"
@@ -53,10 +76,14 @@ async def weather(message: Message):
                 f" Ветер:  {data['wind']['speed']} м/с"
             )
         else:
-            if response.status_code == 404:
+            if status_code == 404:
                 weather_info = "Город не найден"
+            elif status_code == 429 or status_code >= 500:
+                weather_info = "⏳ Сервис погоды сейчас перегружен, попробуйте через минуту"
             else:
-                weather_info = f"Ошибка при получении информации о погоде: {response.status_code}"
+                weather_info = f"Ошибка при получении информации о погоде: {status_code}"
+    except UpstreamUnavailable as e:
+        weather_info = f"⏳ Погода временно недоступна: {e}"
     except Exception as e:
         weather_info = f"Ошибка при получении информации о погоде: {e}"
     await message.answer(weather_info)
@@ -67,13 +94,17 @@ async def aitext(message: Message):
 
 @dp.message(F.photo)
 async def react_photo(message: Message):
-    # Генерация имени файла
     photo = message.photo[-1]  # Берём фото наилучшего качества
-    file_name = f"{PHOTO_DIR}/{photo.file_id}.jpg"
 
-    # Скачивание фото
-    await bot.download(photo, destination=file_name)
-    await message.answer("Фото сохранено!")
+    # Скачивание идёт в фоне, отвечаем сразу
+    try:
+        if photo_ingest.submit(photo):
+            await message.answer("Фото сохранено!")
+        else:
+            await message.answer("Это фото у меня уже есть!")
+    except asyncio.QueueFull:
+        await message.answer("Сейчас слишком много фото, попробуйте позже.")
+        return
 
     # Произвольный ответ
     list = ['Ого, какая фотка!',
@@ -85,32 +116,24 @@ async def react_photo(message: Message):
 
 @dp.message(Command('photo'))
 async def photo(message: Message):
-    # Путь к папке с фото
-    photo_dir = "img"
-
-    # Проверяем, существует ли папка
-    if not os.path.exists(photo_dir):
-        await message.answer("Папка img не найдена!")
-        return
-
-    # Получаем список файлов, оставляем только изображения
-    photo_extensions = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif')
-    photos = [f for f in os.listdir(photo_dir) if f.lower().endswith(photo_extensions)]
+    # Выбираем случайное фото из индекса (без сканирования папки)
+    photo_path = photo_index.random_path()
+    # Файл могли удалить вручную — убираем его из индекса и пробуем другой
+    while photo_path is not None and not os.path.exists(photo_path):
+        photo_index.remove(photo_path)
+        photo_path = photo_index.random_path()
 
     # Если нет фото — сообщаем об этом
-    if not photos:
+    if photo_path is None:
         await message.answer("В папке img нет фото!")
         return
 
-    # Выбираем случайное фото
-    random_photo = random.choice(photos)
-    photo_path = os.path.join(photo_dir, random_photo)
-
     # Отправляем фото
     try:
-        await message.answer_photo(
-            photo=FSInputFile(photo_path),
-            caption=f"Случайное фото: {random_photo}"
+        await answer_with_file(
+            message.answer_photo, photo_path,
+            lambda sent: sent.photo[-1].file_id,
+            caption=f"Случайное фото: {os.path.basename(photo_path)}"
         )
     except Exception as e:
         await message.answer(f"Не удалось отправить фото: {e}")
@@ -119,8 +142,9 @@ async def photo(message: Message):
 async def send_voice(message: Message):
     # Голосовое сообщение (файл должен быть в папке или можно использовать ссылку)
     # Здесь пример с готовым .ogg файлом. Создайте или загрузите voice.ogg
-    voice = FSInputFile("voice.ogg")
-    await message.answer_voice(voice, caption="Вот тебе голосовое сообщение!")
+    await answer_with_file(message.answer_voice, "voice.ogg",
+                           lambda sent: sent.voice.file_id,
+                           caption="Вот тебе голосовое сообщение!")
 
 @dp.message(Command('voice_en'))
 async def voice_en(message: Message):
@@ -130,13 +154,10 @@ async def voice_en(message: Message):
             await message.answer("Введите текст после команды. Например: /voice_en Привет!")
             return
         text_to_speak = parts[1].strip()
-        # Инициализация переводчика
-        translator = Translator()
 
         # Перевод текста с любого языка на английский
         # (src='auto' определяет язык автоматически)
-        translation = translator.translate(text_to_speak, src='auto', dest='en')
-        translated_text = translation.text
+        translated_text = await translator.translate(text_to_speak, src='auto', dest='en')
 
         # Отправляем текст перевода
         await message.reply(f"🇬🇧 {translated_text}")
@@ -154,45 +175,70 @@ async def voice_ru(message: Message):
         await message.answer("Введите текст после команды. Например: /voice_ru Привет!")
         return
     text_to_speak = parts[1].strip()
-    await message.answer(f"📢 {text_to_speak}")
+    caption = f"📢 {text_to_speak}"
+    if len(caption) > CAPTION_LIMIT:
+        await message.answer(caption)
+        caption = None
 
-    await send_voice_message(message,text_to_speak, lang='ru')
+    # Текст — подписью к голосовому: одно сообщение в чат вместо двух
+    await send_voice_message(message, text_to_speak, lang='ru', caption=caption)
 
-async def send_voice_message(message: Message, text: str, lang: str = 'en'):
+async def send_voice_message(message: Message, text: str, lang: str = 'en', caption: str | None = None):
     """
     Функция для озвучивания текста и отправки его как голосового сообщения
     :param message: объект сообщения от пользователя (нужен для контекста)
     :param text: текст, который нужно озвучить
     :param lang: язык озвучки (по умолчанию — английский)
+    :param caption: подпись к голосовому; если его не удалось создать, подпись уходит отдельным сообщением
     """
     try:
-        # Создаём объект для синтеза речи
-        tts = gTTS(text=text, lang=lang)
-
-        # Имя временного файла
-        voice_file = "temp_voice_message.ogg"
-
-        # Сохраняем аудио
-        tts.save(voice_file)
-
-        # Отправляем голосовое сообщение
-        voice = FSInputFile(voice_file)
-        await message.answer_voice(voice)
-
-        # Удаляем файл после отправки
-        os.remove(voice_file)
+        # Синтез в пуле потоков (или готовый результат из кэша)
+        audio = await tts_cache.synthesize(text, lang)
 
+        # Отправляем голосовое сообщение прямо из памяти, без временных файлов
+        voice = BufferedInputFile(audio, filename="voice.ogg")
+        await message.answer_voice(voice, caption=caption)
     except Exception as e:
+        if caption:
+            await message.answer(caption)
         await message.answer(f"Не удалось создать голосовое сообщение: {e}")
         print(f"Ошибка в send_voice_message: {e}")
 
+async def answer_with_file(send, path: str, get_file_id, **kwargs):
+    """
+    Отправляет локальный файл, используя сохранённый file_id, если он есть.
+    :param send: метод отправки, например message.answer_photo
+    :param path: путь к локальному файлу
+    :param get_file_id: функция, достающая file_id из отправленного сообщения
+    """
+    file_id = await file_ids.get(path)
+    if file_id:
+        try:
+            return await send(file_id, **kwargs)
+        except TelegramBadRequest:
+            await file_ids.forget(path)  # file_id устарел — загрузим файл заново
+    sent = await send(FSInputFile(path), **kwargs)
+    await file_ids.set(path, get_file_id(sent))
+    return sent
+
 @dp.message()
 async def answer_msg(message: Message):
      str = f"Я не знаю, что ответить на '{message.text}'"
      await message.answer(str)
 
 async def main():
-    await dp.start_polling(bot)
+    setup_metrics(dp)
+    update_scheduler = setup_update_scheduler(dp)  # чаты параллельно, внутри чата — по порядку
+    dp.startup.register(photo_ingest.start)
+    # Остановка по порядку регистрации: сначала дорабатывает очередь обновлений,
+    # затем закрывается то, чем пользуются обработчики
+    dp.shutdown.register(update_scheduler.close)
+    dp.shutdown.register(photo_ingest.stop)
+    dp.shutdown.register(close_http_client)
+    dp.shutdown.register(tts_cache.close)
+    dp.shutdown.register(translator.close)
+    dp.shutdown.register(send_scheduler.close)
+    await run_bot(dp, bot)  # polling или вебхук (BOT_MODE)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,192 @@
+import contextvars
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable
+
+from aiohttp import web
+from aiogram import Dispatcher
+from aiogram.types import TelegramObject
+
+# --- Настройки эндпоинта метрик (переменные окружения) ---
+# METRICS_PORT=0 отключает HTTP-эндпоинт, метрики при этом всё равно собираются
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Имя обработчика, внутри которого сейчас выполняется код (для внешних вызовов)
+current_handler: contextvars.ContextVar[str] = contextvars.ContextVar("current_handler", default="none")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *label_values: str, amount: float = 1.0):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values: str, value: float):
+        self._values[label_values] = value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self.buckets = tuple(buckets)
+        # значения меток -> (счётчики по корзинам, сумма, количество)
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, *label_values: str, value: float):
+        item = self._values.get(label_values)
+        if item is None:
+            item = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                item[0][i] += 1
+                break
+        item[1] += value
+        item[2] += 1
+
+    def count(self, *label_values: str) -> int:
+        item = self._values.get(label_values)
+        return item[2] if item else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (bucket_counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            inf_labels = _format_labels(self.labels, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+# --- Метрики бота ---
+HANDLER_LATENCY = Histogram("bot_handler_duration_seconds", "Время работы обработчика", ("handler",))
+HANDLER_IN_FLIGHT = Gauge("bot_handler_in_flight", "Обработчиков выполняется сейчас", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+EXTERNAL_LATENCY = Histogram("bot_external_call_duration_seconds",
+                             "Время ожидания внешних вызовов", ("service", "handler"))
+EXTERNAL_ERRORS = Counter("bot_external_call_errors_total", "Ошибки внешних вызовов", ("service", "handler"))
+
+REGISTRY: list = [HANDLER_LATENCY, HANDLER_IN_FLIGHT, HANDLER_ERRORS, EXTERNAL_LATENCY, EXTERNAL_ERRORS]
+
+
+def render_metrics() -> str:
+    """
+    Все метрики в текстовом формате Prometheus.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@asynccontextmanager
+async def track_external(service: str):
+    """
+    Замеряет ожидание внешнего сервиса (OpenWeather, gTTS, googletrans, DaData, SQLite).
+    Пример: async with track_external("openweather"): ...
+    """
+    handler = current_handler.get()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        EXTERNAL_ERRORS.inc(service, handler)
+        raise
+    finally:
+        EXTERNAL_LATENCY.observe(service, handler, value=time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    """
+    Inner-middleware: латентность, число выполняющихся обработчиков и ошибки по имени обработчика.
+    """
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        token = current_handler.set(name)
+        HANDLER_IN_FLIGHT.inc(name)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(name, value=time.perf_counter() - start)
+            HANDLER_IN_FLIGHT.dec(name)
+            current_handler.reset(token)
+
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+def setup_metrics(dp: Dispatcher, host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """
+    Подключает сбор метрик к диспетчеру и поднимает эндпоинт /metrics на время работы бота.
+    """
+    metrics_middleware = MetricsMiddleware()
+    dp.message.middleware(metrics_middleware)
+    dp.callback_query.middleware(metrics_middleware)
+    if not port:
+        return
+
+    runner = web.AppRunner(web.Application())
+    runner.app.router.add_get("/metrics", _metrics_view)
+
+    async def start_server():
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+            print(f"Метрики доступны на http://{host}:{port}/metrics")
+        except OSError as e:
+            # Порт занят (например, другим ботом) — работаем без эндпоинта
+            print(f"Не удалось запустить эндпоинт метрик: {e}")
+
+    async def stop_server():
+        await runner.cleanup()
+
+    dp.startup.register(start_server)
+    dp.shutdown.register(stop_server)
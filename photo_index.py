@@ -0,0 +1,114 @@
+import os
+import random
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif')
+INDEX_FILE_NAME = ".photo_index"
+
+
+class PhotoIndex:
+    """
+    Индекс изображений в папке с фото.
+    Хранит список относительных путей и позицию каждого пути в списке,
+    поэтому добавление, удаление и случайный выбор работают за O(1).
+    На диске индекс — журнал строк: «путь» (добавлен) или «-путь» (удалён).
+    """
+
+    def __init__(self, photo_dir: str, index_file: str | None = None):
+        self.photo_dir = photo_dir
+        self.index_file = index_file or os.path.join(photo_dir, INDEX_FILE_NAME)
+        self._paths: list[str] = []
+        self._positions: dict[str, int] = {}
+
+    def load(self):
+        """
+        Загружает индекс из файла; если файла нет — один раз сканирует папку.
+        """
+        if os.path.exists(self.index_file):
+            removed = 0
+            with open(self.index_file, encoding="utf-8") as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if line.startswith("-"):
+                        self._discard(line[1:])
+                        removed += 1
+                    elif line:
+                        self._add(line)
+            if removed:
+                self._save()  # сжимаем журнал
+        else:
+            self.rebuild()
+
+    def rebuild(self):
+        """
+        Полностью пересобирает индекс по содержимому папки.
+        """
+        self._paths.clear()
+        self._positions.clear()
+        for root, dirs, files in os.walk(self.photo_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if name.lower().endswith(PHOTO_EXTENSIONS):
+                    self._add(os.path.relpath(os.path.join(root, name), self.photo_dir))
+        self._save()
+
+    def add(self, path: str):
+        """
+        Добавляет новое фото в индекс и дописывает его в журнал.
+        :param path: путь к файлу (абсолютный или относительно папки с фото)
+        """
+        rel_path = self._relative(path)
+        if not rel_path.lower().endswith(PHOTO_EXTENSIONS) or rel_path in self._positions:
+            return
+        self._add(rel_path)
+        self._append(rel_path)
+
+    def remove(self, path: str):
+        """
+        Удаляет фото из индекса (например, если файл пропал с диска).
+        """
+        rel_path = self._relative(path)
+        if rel_path in self._positions:
+            self._discard(rel_path)
+            self._append(f"-{rel_path}")
+
+    def random_path(self) -> str | None:
+        """
+        Возвращает путь к случайному фото или None, если фото нет.
+        """
+        if not self._paths:
+            return None
+        return os.path.join(self.photo_dir, random.choice(self._paths))
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def _relative(self, path: str) -> str:
+        if os.path.isabs(path) or path.startswith(self.photo_dir + os.sep):
+            return os.path.relpath(path, self.photo_dir)
+        return path
+
+    def _add(self, rel_path: str):
+        if rel_path not in self._positions:
+            self._positions[rel_path] = len(self._paths)
+            self._paths.append(rel_path)
+
+    def _discard(self, rel_path: str):
+        # Переносим последний элемент на место удаляемого — O(1)
+        position = self._positions.pop(rel_path, None)
+        if position is None:
+            return
+        last = self._paths.pop()
+        if position < len(self._paths):
+            self._paths[position] = last
+            self._positions[last] = position
+
+    def _append(self, line: str):
+        with open(self.index_file, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def _save(self):
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for rel_path in self._paths:
+                f.write(rel_path + "\n")
+        os.replace(tmp_file, self.index_file)
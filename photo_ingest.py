@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import os
+import uuid
+
+from aiogram import Bot
+from aiogram.types import PhotoSize
+
+from photo_index import PhotoIndex
+
+# --- Настройки загрузки фото ---
+INGEST_WORKERS = 4         # одновременных скачиваний
+INGEST_QUEUE_SIZE = 1000   # фото в очереди
+INGEST_LOG_NAME = ".ingest_log"
+INGEST_TMP_DIR = ".tmp"
+
+
+class _HashingWriter:
+    """
+    Файловый объект для bot.download_file: пишет чанки на диск
+    и одновременно считает SHA-256 содержимого.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, chunk: bytes) -> int:
+        self.sha256.update(chunk)
+        return self._f.write(chunk)
+
+    def flush(self):
+        self._f.flush()
+
+    def seek(self, *args):
+        return self._f.seek(*args)
+
+
+class PhotoIngestQueue:
+    """
+    Фоновая очередь скачивания фото с ограниченным числом воркеров.
+    Повторы отсекаются по file_unique_id (до скачивания) и по SHA-256 содержимого (после).
+    Файлы хранятся по содержимому: img/ab/cd/<sha256>.jpg.
+    Журнал img/.ingest_log (file_unique_id, sha256, путь) переживает перезапуск.
+    """
+
+    def __init__(self, bot: Bot, photo_dir: str, index: PhotoIndex,
+                 workers: int = INGEST_WORKERS, queue_size: int = INGEST_QUEUE_SIZE):
+        self.bot = bot
+        self.photo_dir = photo_dir
+        self.index = index
+        self.workers = workers
+        self.log_file = os.path.join(photo_dir, INGEST_LOG_NAME)
+        self.tmp_dir = os.path.join(photo_dir, INGEST_TMP_DIR)
+        self._queue: asyncio.Queue[PhotoSize] = asyncio.Queue(maxsize=queue_size)
+        self._tasks: list[asyncio.Task] = []
+        self._by_unique_id: dict[str, str] = {}   # file_unique_id -> sha256
+        self._by_hash: dict[str, str] = {}        # sha256 -> относительный путь
+        self._queued: set[str] = set()             # file_unique_id в очереди или в работе
+
+    def load(self):
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        if not os.path.exists(self.log_file):
+            return
+        with open(self.log_file, encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) == 3:
+                    unique_id, sha256, rel_path = parts
+                    self._by_unique_id[unique_id] = sha256
+                    self._by_hash[sha256] = rel_path
+
+    async def start(self):
+        self.load()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, photo: PhotoSize) -> bool:
+        """
+        Ставит фото в очередь на скачивание.
+        :return: False, если такое фото уже сохранено или уже скачивается
+        :raises asyncio.QueueFull: если очередь переполнена
+        """
+        unique_id = photo.file_unique_id
+        if unique_id in self._by_unique_id or unique_id in self._queued:
+            return False
+        self._queue.put_nowait(photo)
+        self._queued.add(unique_id)
+        return True
+
+    async def join(self):
+        await self._queue.join()
+
+    async def _worker(self):
+        while True:
+            photo = await self._queue.get()
+            try:
+                await self._ingest(photo)
+            except Exception as e:
+                print(f"Ошибка при сохранении фото {photo.file_unique_id}: {e}")
+            finally:
+                self._queued.discard(photo.file_unique_id)
+                self._queue.task_done()
+
+    async def _ingest(self, photo: PhotoSize):
+        file = await self.bot.get_file(photo.file_id)
+        tmp_path = os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.part")
+        try:
+            # Потоковое скачивание прямо в файл с подсчётом хэша по ходу
+            with open(tmp_path, "wb") as f:
+                writer = _HashingWriter(f)
+                await self.bot.download_file(file.file_path, destination=writer, seek=False)
+            sha256 = writer.sha256.hexdigest()
+
+            rel_path = self._by_hash.get(sha256)
+            if rel_path is None:
+                rel_path = os.path.join(sha256[:2], sha256[2:4], f"{sha256}.jpg")
+                dest_path = os.path.join(self.photo_dir, rel_path)
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                os.replace(tmp_path, dest_path)
+                self._by_hash[sha256] = rel_path
+                self.index.add(dest_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)  # дубликат по содержимому или ошибка скачивания
+
+        self._by_unique_id[photo.file_unique_id] = sha256
+        with open(self.log_file, "a", encoding="utf-8") as f:
+            f.write(f"{photo.file_unique_id}\t{sha256}\t{rel_path}\n")
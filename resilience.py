@@ -0,0 +1,345 @@
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable
+
+import httpx
+
+from metrics import Counter, Gauge, REGISTRY
+
+# --- Метрики внешних сервисов ---
+UPSTREAM_LIMIT = Gauge("bot_upstream_concurrency_limit", "Текущий адаптивный лимит одновременных запросов", ("service",))
+UPSTREAM_IN_FLIGHT = Gauge("bot_upstream_in_flight", "Запросов к сервису выполняется сейчас", ("service",))
+UPSTREAM_RETRIES = Counter("bot_upstream_retries_total", "Повторы запросов к внешним сервисам", ("service",))
+UPSTREAM_REJECTED = Counter("bot_upstream_rejected_total",
+                            "Запросы, отклонённые без обращения к сервису", ("service", "reason"))
+UPSTREAM_CIRCUIT = Gauge("bot_upstream_circuit_state", "Состояние предохранителя: 0 — закрыт, 1 — открыт, 2 — проба",
+                         ("service",))
+UPSTREAM_QUOTA_USED = Gauge("bot_upstream_quota_used", "Израсходовано запросов в текущем периоде квоты", ("service",))
+REGISTRY.extend([UPSTREAM_LIMIT, UPSTREAM_IN_FLIGHT, UPSTREAM_RETRIES, UPSTREAM_REJECTED,
+                 UPSTREAM_CIRCUIT, UPSTREAM_QUOTA_USED])
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Запрос не отправлялся: сервис сейчас не принимает запросы от бота.
+    """
+    reason = "unavailable"
+
+    def __init__(self, service: str, retry_in: float = 0.0):
+        self.service = service
+        self.retry_in = retry_in
+        super().__init__(self.describe())
+
+    def describe(self) -> str:
+        return f"сервис {self.service} временно недоступен, попробуйте через {max(1, round(self.retry_in))} с"
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    reason = "circuit_open"
+
+
+class OverloadedError(UpstreamUnavailable):
+    reason = "overloaded"
+
+    def describe(self) -> str:
+        return f"сервис {self.service} перегружен, попробуйте чуть позже"
+
+
+class QuotaExceededError(UpstreamUnavailable):
+    reason = "quota"
+
+    def describe(self) -> str:
+        return f"исчерпана квота запросов к {self.service}, она обновится через {max(1, round(self.retry_in))} с"
+
+
+class AdaptiveLimiter:
+    """
+    Лимит одновременных запросов по схеме AIMD: после каждого успешного ответа лимит
+    растёт примерно на 1 за «окно» запросов, при перегрузке сервиса (таймаут, 429, 5xx)
+    уменьшается в backoff раз, не чаще раза в decrease_interval.
+    Кто не дождался свободного места за max_wait, получает OverloadedError —
+    обработчики не копятся в очереди, пока сервис деградирует.
+    """
+
+    def __init__(self, service: str, initial: int = 8, min_limit: int = 1, max_limit: int = 64,
+                 backoff: float = 0.5, max_wait: float = 2.0, decrease_interval: float = 1.0):
+        self.service = service
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.decrease_interval = decrease_interval
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        UPSTREAM_LIMIT.set(service, value=self.limit)
+
+    async def acquire(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self._take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            # Место передаётся ожидающему в release(), поэтому _take() здесь не нужен
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            raise OverloadedError(self.service, self.max_wait) from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(None)  # место уже выдали, а вызывающего отменили
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+
+    def _take(self):
+        self.in_flight += 1
+        UPSTREAM_IN_FLIGHT.set(self.service, value=self.in_flight)
+
+    def release(self, success: bool | None):
+        """
+        :param success: True — сервис ответил, False — признак перегрузки, None — не учитывать
+        """
+        self.in_flight -= 1
+        if success:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif success is False:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.decrease_interval:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+        UPSTREAM_LIMIT.set(self.service, value=self.limit)
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.popleft()
+            if not future.done():
+                self._take()
+                future.set_result(None)
+        UPSTREAM_IN_FLIGHT.set(self.service, value=self.in_flight)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold сбоев подряд запросы сразу получают
+    CircuitOpenError, пока не пройдёт reset_timeout. Затем пропускается один пробный
+    запрос: успех закрывает предохранитель, сбой снова открывает его.
+    """
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, service: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        UPSTREAM_CIRCUIT.set(service, value=self.state)
+
+    def before_call(self) -> bool:
+        """
+        :return: True, если этот вызов — пробный запрос; значение передаётся в abandon()
+        :raises CircuitOpenError: предохранитель открыт
+        """
+        if self.state == self.CLOSED:
+            return False
+        retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+        if self.state == self.OPEN and retry_in <= 0:
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        raise CircuitOpenError(self.service, max(retry_in, 1.0))
+
+    def abandon(self, probe: bool):
+        """
+        Запрос завершился, ничего не сказав о сервисе (отмена, перегрузка, квота, ошибка запроса).
+        Если это был пробный запрос — пропустить следующий; обычный вызов чужую пробу не сбрасывает.
+        :param probe: результат before_call() этого вызова
+        """
+        if probe:
+            self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            if self.state != self.OPEN:
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state: int):
+        self.state = state
+        UPSTREAM_CIRCUIT.set(self.service, value=state)
+        names = {self.CLOSED: "закрыт", self.OPEN: "открыт", self.HALF_OPEN: "пробный запрос"}
+        print(f"Предохранитель {self.service}: {names[state]}")
+
+
+class Quota:
+    """
+    Учёт квоты: число запросов за период (например, суточный лимит тарифа).
+    При limit=None только считает, иначе по исчерпании бросает QuotaExceededError.
+    """
+
+    def __init__(self, service: str, limit: int | None = None, period: float = 24 * 3600):
+        self.service = service
+        self.limit = limit
+        self.period = period
+        self.used = 0
+        self.window_start = time.monotonic()
+
+    def consume(self):
+        now = time.monotonic()
+        if now - self.window_start >= self.period:
+            self.window_start, self.used = now, 0
+        if self.limit is not None and self.used >= self.limit:
+            raise QuotaExceededError(self.service, self.window_start + self.period - now)
+        self.used += 1
+        UPSTREAM_QUOTA_USED.set(self.service, value=self.used)
+
+
+@dataclass
+class RetryPolicy:
+    attempts: int = 3             # всего попыток, включая первую
+    base_delay: float = 0.2       # секунд, удваивается с каждой попыткой
+    max_delay: float = 2.0        # потолок паузы между попытками
+    max_retry_after: float = 5.0  # если сервис просит ждать дольше, не повторяем
+
+    def delay(self, attempt: int, retry_after: float | None) -> float | None:
+        """
+        Пауза перед повтором («full jitter») или None, если повторять не стоит.
+        :param attempt: номер неудачной попытки, с нуля
+        """
+        jitter = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is None:
+            return jitter
+        if retry_after > self.max_retry_after:
+            return None
+        return max(retry_after, jitter)
+
+
+def retry_after_seconds(error: BaseException) -> float | None:
+    """
+    Значение заголовка Retry-After (секунды или HTTP-дата) из ответа с ошибкой.
+    """
+    # httpx.HTTPStatusError.response или gTTSError.rsp (ответ requests)
+    response = getattr(error, "response", None) or getattr(error, "rsp", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Сбой на стороне сервиса (повторяем, снижаем лимит, считаем в предохранителе).
+    Остальные ошибки — 4xx, неверные данные — означают, что сервис работает.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError, OSError))
+
+
+class Upstream:
+    """
+    Устойчивый вызов внешнего сервиса: предохранитель → адаптивный лимит → квота →
+    запрос с таймаутом попытки → повтор с паузой (Retry-After или backoff с jitter),
+    пока не кончились попытки или общее время deadline.
+    Пример: await upstream.call(lambda: client.get(url))
+    """
+
+    def __init__(self, service: str, limiter: AdaptiveLimiter | None = None, breaker: CircuitBreaker | None = None,
+                 retry: RetryPolicy | None = None, quota: Quota | None = None, attempt_timeout: float = 10.0,
+                 deadline: float = 15.0, failure_types: tuple[type[BaseException], ...] = ()):
+        """
+        :param failure_types: дополнительные исключения, означающие сбой сервиса (например, gTTSError)
+        """
+        self.service = service
+        self.limiter = limiter or AdaptiveLimiter(service)
+        self.breaker = breaker or CircuitBreaker(service)
+        self.retry = retry or RetryPolicy()
+        self.quota = quota or Quota(service)
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.failure_types = failure_types
+
+    def is_failure(self, error: BaseException) -> bool:
+        return isinstance(error, self.failure_types) or is_upstream_failure(error)
+
+    async def call(self, func: Callable[[], Awaitable[Any]], retry: bool = True) -> Any:
+        """
+        :param func: фабрика корутины с одной попыткой запроса
+        :param retry: повторять при сбое; False для неидемпотентных запросов (платных, меняющих данные) —
+            после таймаута неизвестно, выполнил ли сервис запрос, и повтор может выполнить его дважды
+        :raises UpstreamUnavailable: запрос не отправлялся (предохранитель, перегрузка, квота)
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        attempt = 0
+        while True:
+            try:
+                probe = self.breaker.before_call()
+            except UpstreamUnavailable as e:
+                UPSTREAM_REJECTED.inc(self.service, e.reason)
+                raise
+            try:
+                await self.limiter.acquire()
+            except BaseException as e:
+                self.breaker.abandon(probe)
+                if isinstance(e, UpstreamUnavailable):
+                    UPSTREAM_REJECTED.inc(self.service, e.reason)
+                raise
+            try:
+                self.quota.consume()
+            except UpstreamUnavailable as e:
+                self.limiter.release(None)
+                self.breaker.abandon(probe)
+                UPSTREAM_REJECTED.inc(self.service, e.reason)
+                raise
+
+            try:
+                timeout = min(self.attempt_timeout, max(deadline - loop.time(), 0.001))
+                result = await asyncio.wait_for(func(), timeout)
+            except Exception as e:
+                if not self.is_failure(e):
+                    # 4xx, битый JSON и т.п. — ошибка запроса, о здоровье сервиса она ничего не говорит
+                    self.limiter.release(None)
+                    self.breaker.abandon(probe)
+                    raise
+                self.limiter.release(False)
+                self.breaker.record_failure()
+                if not retry:
+                    raise
+                delay = self.retry.delay(attempt, retry_after_seconds(e))
+                attempt += 1
+                if delay is None or attempt >= self.retry.attempts or loop.time() + delay >= deadline:
+                    raise
+                UPSTREAM_RETRIES.inc(self.service)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Отмена вызывающего — не признак состояния сервиса
+                self.limiter.release(None)
+                self.breaker.abandon(probe)
+                raise
+            self.limiter.release(True)
+            self.breaker.record_success()
+            return result
@@ -0,0 +1,276 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage, TelegramMethod
+
+# --- Лимиты Telegram (с небольшим запасом) ---
+GLOBAL_RATE = 28.0      # сообщений в секунду на бота
+GLOBAL_BURST = 30
+CHAT_RATE = 1.0         # сообщений в секунду в один чат
+CHAT_BURST = 3
+MAX_RETRIES = 3         # повторов после 429 Too Many Requests
+RETRY_AFTER_WINDOW = 1.0    # секунд: 429 в разных чатах за это время — значит, упёрлись в лимит бота
+CHAT_BUCKET_IDLE = 60.0     # секунд без отправок, после которых лимит чата забывается
+CHAT_BUCKET_SWEEP = 60.0    # секунд между очистками забытых лимитов чатов
+MESSAGE_LIMIT = 4096    # символов в одном сообщении
+CAPTION_LIMIT = 1024    # символов в подписи к медиа
+
+# Приоритеты: ответы пользователю идут раньше массовых рассылок
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+send_priority: contextvars.ContextVar[int] = contextvars.ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+# Методы, которые расходуют лимит сообщений в чат
+_SCHEDULED_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+
+
+@contextmanager
+def bulk_sends():
+    """
+    Помечает отправки внутри блока как массовые (низкий приоритет).
+    Пример: with bulk_sends(): await bot.send_message(...)
+    """
+    token = send_priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # пауза после 429
+
+    def wait_time(self, now: float) -> float:
+        """
+        Сколько секунд ждать до появления токена (0 — можно отправлять).
+        """
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+@dataclass
+class _Pending:
+    make_request: NextRequestMiddlewareType
+    bot: Bot
+    method: TelegramMethod
+    priority: int
+    seq: int
+    futures: list[asyncio.Future] = field(default_factory=list)
+    retries: int = 0
+    chat_was_idle: bool = False  # перед отправкой лимит чата был не тронут
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """
+    Request-middleware сессии бота: очередь исходящих сообщений.
+    - лимиты token bucket на чат и на бота целиком;
+    - порядок внутри чата сохраняется, в чат одновременно летит не больше одного запроса;
+    - из разных чатов первыми уходят интерактивные ответы, затем массовые (bulk_sends);
+    - подряд стоящие в очереди текстовые сообщения в один чат склеиваются в одно;
+    - после 429 чат ставится на паузу на retry_after, запрос повторяется; если 429 не объясняется
+      лимитом этого чата (чат до этого молчал или 429 пришёл сразу в нескольких чатах),
+      на паузу ставится весь бот;
+    - лимиты чатов, в которые давно ничего не отправляли, периодически удаляются.
+    Подключение: bot.session.middleware(SendScheduler())
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, global_burst: int = GLOBAL_BURST,
+                 chat_rate: float = CHAT_RATE, chat_burst: int = CHAT_BURST, coalesce: bool = True):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.coalesce = coalesce
+        self._chat_buckets: dict[Any, TokenBucket] = {}
+        self._queues: dict[Any, deque[_Pending]] = {}
+        self._in_flight: set[Any] = set()
+        self._ready: list[tuple[int, int, Any]] = []            # (приоритет, seq, чат)
+        self._delayed: list[tuple[float, int, int, Any]] = []   # (когда, приоритет, seq, чат)
+        self._seq = itertools.count()
+        self._last_retry_after: dict[Any, float] = {}  # чат -> когда получили 429
+        self._last_sweep = time.monotonic()
+        self._wakeup: asyncio.Event | None = None
+        self._loop_task: asyncio.Task | None = None
+        # Ссылки на задачи отправки: цикл событий хранит только слабые, без них задачу может собрать GC
+        self._send_tasks: set[asyncio.Task] = set()
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(_SCHEDULED_PREFIXES):
+            return await make_request(bot, method)
+
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        item = _Pending(make_request, bot, method, send_priority.get(), next(self._seq), [future])
+        queue = self._queues.setdefault(chat_id, deque())
+        queue.append(item)
+        if len(queue) == 1 and chat_id not in self._in_flight:
+            heapq.heappush(self._ready, (item.priority, item.seq, chat_id))
+            self._wakeup.set()
+        return await future
+
+    def _ensure_started(self):
+        if self._loop_task is None or self._loop_task.done():
+            self._wakeup = asyncio.Event()
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        # Уже отправленные запросы дожидаемся: их ждут обработчики
+        if self._send_tasks:
+            await asyncio.gather(*self._send_tasks, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            if now - self._last_sweep >= CHAT_BUCKET_SWEEP:
+                self._sweep_buckets(now)
+            while self._delayed and self._delayed[0][0] <= now:
+                _, priority, seq, chat_id = heapq.heappop(self._delayed)
+                heapq.heappush(self._ready, (priority, seq, chat_id))
+
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                if self._chat_buckets:
+                    sweep_in = max(0.0, self._last_sweep + CHAT_BUCKET_SWEEP - now)
+                    timeout = sweep_in if timeout is None else min(timeout, sweep_in)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait:
+                await asyncio.sleep(global_wait)
+                continue
+
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            chat_wait = bucket.wait_time(now)
+            if chat_wait:
+                # Чат упёрся в свой лимит — не задерживаем остальные чаты
+                heapq.heappush(self._delayed, (now + chat_wait, priority, seq, chat_id))
+                continue
+
+            chat_was_idle = bucket.tokens >= bucket.capacity
+            bucket.take()
+            self.global_bucket.take()
+            item = self._take_next(chat_id)
+            item.chat_was_idle = chat_was_idle
+            self._in_flight.add(chat_id)
+            task = asyncio.create_task(self._send(chat_id, item))
+            self._send_tasks.add(task)
+            task.add_done_callback(self._send_tasks.discard)
+
+    def _take_next(self, chat_id: Any) -> _Pending:
+        queue = self._queues[chat_id]
+        item = queue.popleft()
+        if self.coalesce and isinstance(item.method, SendMessage):
+            while queue and self._can_merge(item, queue[0]):
+                following = queue.popleft()
+                merged_text = f"{item.method.text}\n\n{following.method.text}"
+                item.method = following.method.model_copy(update={"text": merged_text})
+                item.futures.extend(following.futures)
+        return item
+
+    @staticmethod
+    def _can_merge(first: _Pending, second: _Pending) -> bool:
+        if not isinstance(second.method, SendMessage) or first.priority != second.priority:
+            return False
+        # Клавиатура допустима только у последнего сообщения, entities привязаны к смещениям
+        if first.method.reply_markup is not None or first.method.entities or second.method.entities:
+            return False
+        if len(first.method.text) + len(second.method.text) + 2 > MESSAGE_LIMIT:
+            return False
+        exclude = {"text", "reply_markup"}
+        return first.method.model_dump(exclude=exclude) == second.method.model_dump(exclude=exclude)
+
+    async def _send(self, chat_id: Any, item: _Pending):
+        try:
+            result = await item.make_request(item.bot, item.method)
+        except TelegramRetryAfter as e:
+            if item.retries < MAX_RETRIES:
+                # Ставим чат на паузу и повторяем тот же запрос первым в очереди чата
+                item.retries += 1
+                self._pause(chat_id, item, e.retry_after)
+                self._queues[chat_id].appendleft(item)
+                self._release(chat_id)
+                return
+            self._resolve(item, error=e)
+        except Exception as e:
+            self._resolve(item, error=e)
+        else:
+            self._resolve(item, result=result)
+        self._release(chat_id)
+
+    def _release(self, chat_id: Any):
+        self._in_flight.discard(chat_id)
+        queue = self._queues.get(chat_id)
+        if queue:
+            head = queue[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+            self._wakeup.set()
+        else:
+            self._queues.pop(chat_id, None)
+
+    def _pause(self, chat_id: Any, item: _Pending, retry_after: float):
+        now = time.monotonic()
+        until = now + retry_after
+        self._chat_buckets[chat_id].blocked_until = until
+        others_limited = any(other != chat_id and now - when <= RETRY_AFTER_WINDOW
+                             for other, when in self._last_retry_after.items())
+        self._last_retry_after = {other: when for other, when in self._last_retry_after.items()
+                                  if now - when <= RETRY_AFTER_WINDOW}
+        self._last_retry_after[chat_id] = now
+        if item.chat_was_idle or others_limited:
+            # Лимит чата тут ни при чём — останавливаем все отправки, а не только этот чат
+            self.global_bucket.blocked_until = max(self.global_bucket.blocked_until, until)
+
+    def _sweep_buckets(self, now: float):
+        # Бакет, которым не пользовались дольше CHAT_BUCKET_IDLE, давно полон — он ничем не отличается от нового
+        self._last_sweep = now
+        idle = [chat_id for chat_id, bucket in self._chat_buckets.items()
+                if now - bucket.updated >= CHAT_BUCKET_IDLE and now >= bucket.blocked_until
+                and chat_id not in self._queues and chat_id not in self._in_flight]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+
+    @staticmethod
+    def _resolve(item: _Pending, result: Any = None, error: BaseException | None = None):
+        for future in item.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
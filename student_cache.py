@@ -0,0 +1,76 @@
+from aio_utils import LRUCache
+from database import Database, casefold
+
+# --- Настройки кэша студентов ---
+STUDENT_CACHE_SIZE = 10_000   # студентов по ID
+GRADE_CACHE_SIZE = 500        # списков классов
+STUDENT_CACHE_TTL = 300       # секунд
+
+
+class StudentCache:
+    """
+    Read-through кэш поиска студента по ID и списка студентов класса.
+    Изменения через process_grade, edit_set_value, confirm_delete и /import
+    сбрасывают ровно затронутые записи: студента по ID и списки старого и нового класса.
+    """
+
+    def __init__(self, database: Database, size: int = STUDENT_CACHE_SIZE,
+                 grade_size: int = GRADE_CACHE_SIZE, ttl: float = STUDENT_CACHE_TTL):
+        self.database = database
+        self._by_id = LRUCache(size, ttl=ttl)
+        self._by_grade = LRUCache(grade_size, ttl=ttl)
+        # Растёт при каждой инвалидации: чтение, начатое до записи, не кладёт в кэш устаревшие строки
+        self._generation = 0
+
+    async def get_student(self, student_id: int) -> tuple | None:
+        """
+        :return: (id, name, age, grade) или None
+        """
+        row = self._by_id.get(student_id)
+        if row is not None:
+            return row
+        generation = self._generation
+        row = await self.database.fetchone('SELECT id, name, age, grade FROM students WHERE id = ?', (student_id,))
+        if row is not None and generation == self._generation:
+            self._by_id.set(student_id, row)
+        return row
+
+    async def get_grade(self, grade: str) -> list[tuple]:
+        """
+        :return: строки (id, name, age, grade, data) студентов класса, по имени
+        """
+        grade_norm = casefold(grade)
+        rows = self._by_grade.get(grade_norm)
+        if rows is not None:
+            return rows
+        generation = self._generation
+        rows = await self.database.fetchall('''
+            SELECT id, name, age, grade, data FROM students
+            WHERE grade_norm = ?
+            ORDER BY name
+        ''', (grade_norm,))
+        if generation == self._generation:
+            self._by_grade.set(grade_norm, rows)
+        return rows
+
+    def invalidate_insert(self, *grades: str):
+        """
+        Новые студенты меняют только списки своих классов.
+        """
+        self._generation += 1
+        for grade in grades:
+            self._by_grade.pop(casefold(grade))
+
+    def invalidate_student(self, student_id: int, old_grade: str | None, new_grade: str | None = None):
+        """
+        Изменение или удаление студента: сам студент и списки старого и нового класса.
+        :param old_grade: класс до изменения (None — неизвестен, сбрасываем все списки)
+        """
+        self._generation += 1
+        self._by_id.pop(student_id)
+        if old_grade is None:
+            self._by_grade.clear()
+            return
+        self._by_grade.pop(casefold(old_grade))
+        if new_grade is not None:
+            self._by_grade.pop(casefold(new_grade))
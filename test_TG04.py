@@ -1,23 +1,35 @@
 #import aiosqlite
-import requests
 from aiogram import Bot, Dispatcher, F, Router, types
 from aiogram.filters import Command, CommandStart
 from aiogram.types import (
     Message,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
-    CallbackQuery
+    CallbackQuery,
+    FSInputFile
 )
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from config import TG_TOKEN, DADATA_TOKEN, DATA_SECRET_KEY
-from dadata import Dadata
+from dadata_client import DadataAPI
+from ip_geo import IpGeoResolver
+from ip_bulk import geolocate_file
+from resilience import CircuitOpenError, QuotaExceededError, UpstreamUnavailable
+from webhook import run_bot
+from metrics import setup_metrics
+from update_scheduler import setup_update_scheduler
+from send_scheduler import SendScheduler, bulk_sends
+from fsm_storage import SQLiteStorage
 
 import datetime as dt
+import ipaddress
+import os
+from contextlib import suppress
+import re
+import tempfile
 from unittest import mock
 import httpx
-from dadata.asynchr import DadataClient, CleanClient, ProfileClient, SuggestClient
 
 # Создаем роутер
 router = Router()
@@ -36,10 +48,9 @@ class AddressToCadForm(StatesGroup):
     waiting_for_address = State()
 
 # --- Настройка DaData API ---
-DADATA_URL_IP = "https://suggestions.dadata.ru/suggestions/api/4_1/iplocate/{ip}"
+DADATA_URL_IP = "https://suggestions.dadata.ru/suggestions/api/4_1/rs/iplocate/address"
 DADATA_URL_CLEAN_ADDR = "https://cleaner.dadata.ru/api/v1/clean/address"
-DADATA_URL_FIND_ADDR = "https://suggestions.dadata.ru/suggestions/api/4_1/json/findById/address"
-DADATA_URL_CADASTRE_CLEAN = "https://cleaner.dadata.ru/api/v1/clean/cadastre"
+DADATA_URL_FIND_ADDR = "https://suggestions.dadata.ru/suggestions/api/4_1/rs/findById/address"
 
 HEADERS = {
     "Authorization": f"Token {DADATA_TOKEN}",
@@ -47,10 +58,35 @@ HEADERS = {
     "Content-Type": "application/json"
 }
 
+# Один клиент на весь бот: пул соединений с keep-alive, таймауты, адаптивный лимит одновременных запросов
+dadata = DadataAPI(HEADERS, secret=DATA_SECRET_KEY)
+router.startup.register(dadata.open)
+router.shutdown.register(dadata.close)
+
+
+async def dadata_iplocate(ip: str) -> dict | None:
+    """
+    Город по IP-адресу через DaData.
+    :return: подсказка с адресом ({"value": ..., "data": {"city": ...}}) или None, если город не найден
+    """
+    result = await dadata.get(DADATA_URL_IP, params={"ip": ip})
+    return result.get("location")
+
+
+async def dadata_city(ip: str) -> str | None:
+    location = await dadata_iplocate(ip)
+    return (location.get("data") or {}).get("city") if location else None
+
+
+# Кэш по адресу и подсети и локальная база диапазонов (IP_GEO_DB); DaData — только при промахе
+ip_geo = IpGeoResolver(dadata_city)
+router.startup.register(ip_geo.open)
+router.shutdown.register(ip_geo.close)
+
 # --- Команда /ip_town ---
 @router.message(Command("ip_town"))
 async def cmd_ip_town(message: Message, state: FSMContext):
-    await message.answer("Введите IP-адрес:")
+    await message.answer("Введите IP-адрес или отправьте файл (список, CSV или лог) — определю города для всех IP в нём:")
     await state.set_state(IpForm.waiting_for_ip)
 
 
@@ -58,28 +94,200 @@ async def cmd_ip_town(message: Message, state: FSMContext):
 async def process_ip(message: Message, state: FSMContext):
     ip = message.text.strip()
     try:
-        dadata = Dadata(DADATA_TOKEN, DATA_SECRET_KEY  )
-        result = dadata.iplocate(ip)
+        ipaddress.ip_address(ip)
+    except ValueError:
+        await message.answer("❌ Это не IP-адрес. Пример: 77.88.55.1")
+        await state.clear()
+        return
+    try:
+        city = await ip_geo.resolve(ip)
         #await message.answer(f"📍 result по IP {ip}: <b>{result}</b>", parse_mode="HTML")
 
-        if result and "data" in result and result["data"]:
-            city = result["data"]["city"]
+        if city:
             await message.answer(f"📍 Город по IP {ip}: <b>{city}</b>", parse_mode="HTML")
         else:
             await message.answer("❌ Не удалось определить город по указанному IP.")
-    except requests.exceptions.ConnectionError:
-        await message.answer("❌ Ошибка подключения к сервису DaData. Проверьте интернет-соединение.")
-    except requests.exceptions.Timeout:
-        await message.answer("❌ Время ожидания ответа от DaData истекло.")
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 403:
-            await message.answer("❌ Ошибка авторизации DaData: неверный токен.")
-        elif e.response.status_code == 429:
-            await message.answer("❌ Слишком много запросов к DaData. Попробуйте позже.")
+    except Exception as e:
+        await message.answer(dadata_error_text(e, "определении города"))
+    finally:
+        await state.clear()
+
+
+@router.message(IpForm.waiting_for_ip, F.document)
+async def process_ip_file(message: Message, state: FSMContext):
+    await state.clear()
+    document = message.document
+    progress = await message.answer("⏳ Загружаю файл...")
+
+    workdir = tempfile.mkdtemp(prefix="ip_town_")
+    source_path = os.path.join(workdir, "source")
+    result_path = os.path.join(workdir, "result.csv")
+    try:
+        # Файл скачивается потоково на диск, IP схлопываются во временной базе — память не растёт
+        await message.bot.download(document, destination=source_path)
+
+        last_text = progress.text
+
+        async def show_progress(text: str):
+            nonlocal last_text
+            # Прогресс — не главное: «message is not modified» и т.п. не должны прерывать обработку
+            if text != last_text:
+                last_text = text
+                # Прогресс уступает очередь ответам другим пользователям
+                with suppress(TelegramBadRequest), bulk_sends():
+                    await progress.edit_text(text)
+
+        total, found = await geolocate_file(
+            source_path, result_path, ip_geo.resolve, on_progress=show_progress,
+            is_fatal=lambda e: isinstance(e, (CircuitOpenError, QuotaExceededError))
+            or isinstance(e, httpx.HTTPStatusError) and e.response.status_code in (401, 403),
+        )
+        if total:
+            await message.answer_document(
+                FSInputFile(result_path, filename=f"ip_towns_{dt.datetime.now():%Y%m%d_%H%M%S}.csv"),
+                caption=f"📍 Уникальных IP: {total}, город определён для {found}."
+            )
+            await progress.edit_text("✅ Готово.")
+        else:
+            await progress.edit_text("❌ В файле не найдено ни одного IP-адреса.")
+    except Exception as e:
+        await progress.edit_text(dadata_error_text(e, "обработке файла"))
+    finally:
+        for path in (source_path, result_path):
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(workdir)
+
+
+def dadata_error_text(e: Exception, action: str) -> str:
+    """
+    Сообщение пользователю об ошибке запроса к DaData.
+    :param action: что делали, например "определении города"
+    """
+    if isinstance(e, UpstreamUnavailable):
+        return f"⏳ DaData: {e}."
+    if isinstance(e, httpx.TimeoutException):
+        return "❌ Время ожидания ответа от DaData истекло."
+    if isinstance(e, httpx.TransportError):
+        return "❌ Ошибка подключения к сервису DaData. Проверьте интернет-соединение."
+    if isinstance(e, httpx.HTTPStatusError):
+        if e.response.status_code in (401, 403):
+            return "❌ Ошибка авторизации DaData: неверный токен."
+        if e.response.status_code == 429:
+            return "❌ Слишком много запросов к DaData. Попробуйте позже."
+        return f"❌ HTTP ошибка: {e.response.status_code}"
+    return f"❌ Ошибка при {action}: {e}"
+
+
+# --- Стандартизация адреса и кадастровые номера ---
+# qc — код качества стандартизации: 0 — адрес распознан уверенно, 1 — остались лишние части,
+# 2 — пустой или мусорный адрес, 3 — есть альтернативные варианты
+ADDRESS_QC_UNKNOWN = 2
+CAD_NUMBER_RE = re.compile(r"^\d{2}:\d{2}:\d{6,7}:\d{1,}$")
+
+
+async def dadata_clean_address(address: str) -> dict | None:
+    """
+    Стандартизированный адрес (вместе с запросами других чатов — одним вызовом DaData).
+    :return: запись DaData или None, если адрес не распознан
+    """
+    result = await dadata.clean(DADATA_URL_CLEAN_ADDR, address)
+    if not result or result.get("qc") == ADDRESS_QC_UNKNOWN or not result.get("result"):
+        return None
+    return result
+
+
+async def dadata_find_by_cad_number(cad_number: str) -> dict | None:
+    """
+    Адрес по кадастровому номеру дома, квартиры или участка.
+    :return: подсказка DaData ({"value": ..., "data": {...}}) или None
+    """
+    result = await dadata.post(DADATA_URL_FIND_ADDR, {"query": cad_number, "count": 1})
+    suggestions = result.get("suggestions") or []
+    return suggestions[0] if suggestions else None
+
+
+@router.message(Command("address"))
+async def cmd_address(message: Message, state: FSMContext):
+    await message.answer("Введите адрес в свободной форме (например, мск сухонская 11 89):")
+    await state.set_state(AddressForm.waiting_for_address)
+
+
+@router.message(AddressForm.waiting_for_address, F.text)
+async def process_address(message: Message, state: FSMContext):
+    try:
+        result = await dadata_clean_address(message.text.strip())
+        if result:
+            text = f"🏠 Адрес: <b>{result['result']}</b>\n"
+            if result.get("postal_code"):
+                text += f"📮 Индекс: {result['postal_code']}\n"
+            if result.get("geo_lat") and result.get("geo_lon"):
+                text += f"🌐 Координаты: {result['geo_lat']}, {result['geo_lon']}\n"
+            if result.get("timezone"):
+                text += f"🕒 Часовой пояс: {result['timezone']}\n"
+            await message.answer(text, parse_mode="HTML")
+        else:
+            await message.answer("❌ Не удалось распознать адрес.")
+    except Exception as e:
+        await message.answer(dadata_error_text(e, "стандартизации адреса"))
+    finally:
+        await state.clear()
+
+
+@router.message(Command("cad"))
+async def cmd_cad(message: Message, state: FSMContext):
+    await message.answer("Введите кадастровый номер (например, 77:01:0001001:1234):")
+    await state.set_state(CadNumberForm.waiting_for_cad_number)
+
+
+@router.message(CadNumberForm.waiting_for_cad_number, F.text)
+async def process_cad_number(message: Message, state: FSMContext):
+    cad_number = message.text.strip()
+    if not CAD_NUMBER_RE.match(cad_number):
+        await message.answer("❌ Кадастровый номер имеет вид АА:ВВ:CCCCCCC:КК, например 77:01:0001001:1234")
+        await state.clear()
+        return
+    try:
+        result = await dadata_find_by_cad_number(cad_number)
+        if result:
+            text = f"🏠 Адрес по номеру {cad_number}: <b>{result['value']}</b>"
+            postal_code = (result.get("data") or {}).get("postal_code")
+            if postal_code:
+                text += f"\n📮 Индекс: {postal_code}"
+            await message.answer(text, parse_mode="HTML")
+        else:
+            await message.answer("❌ Объект с таким кадастровым номером не найден.")
+    except Exception as e:
+        await message.answer(dadata_error_text(e, "поиске по кадастровому номеру"))
+    finally:
+        await state.clear()
+
+
+@router.message(Command("address_to_cad"))
+async def cmd_address_to_cad(message: Message, state: FSMContext):
+    await message.answer("Введите адрес дома или квартиры:")
+    await state.set_state(AddressToCadForm.waiting_for_address)
+
+
+@router.message(AddressToCadForm.waiting_for_address, F.text)
+async def process_address_to_cad(message: Message, state: FSMContext):
+    try:
+        result = await dadata_clean_address(message.text.strip())
+        cad_numbers = [
+            (label, result[field])
+            for field, label in (("house_cadnum", "Дом"), ("flat_cadnum", "Квартира"), ("stead_cadnum", "Участок"))
+            if result and result.get(field)
+        ]
+        if cad_numbers:
+            text = f"🏠 {result['result']}\n\n" + "\n".join(f"📄 {label}: <code>{number}</code>"
+                                                              for label, number in cad_numbers)
+            await message.answer(text, parse_mode="HTML")
+        elif result:
+            await message.answer(f"❌ Для адреса «{result['result']}» кадастровый номер не найден.")
         else:
-            await message.answer(f"❌ HTTP ошибка: {e.response.status_code}")
+            await message.answer("❌ Не удалось распознать адрес.")
     except Exception as e:
-        await message.answer(f"❌ Ошибка при определении города: {e}")
+        await message.answer(dadata_error_text(e, "поиске кадастрового номера"))
     finally:
         await state.clear()
 
@@ -92,7 +300,10 @@ async def cmd_help(message: Message):
         "/start — показать меню с кнопками «Привет» и «Пока»\n"
         "/links — показать кнопки с ссылками на новости, музыку и видео\n"
         "/dynamic — показать кнопку «Показать больше», которая превращается в две опции\n"
-        "/ip_town — определить город по IP-адресу\n"
+        "/ip_town — определить город по IP-адресу (или по всем IP из файла)\n"
+        "/address — стандартизировать адрес (индекс, координаты)\n"
+        "/cad — найти адрес по кадастровому номеру\n"
+        "/address_to_cad — найти кадастровый номер по адресу\n"
         "/help — показать это сообщение"
     )
     await message.answer(help_text)
@@ -161,9 +372,21 @@ async def callback_option_2(call: CallbackQuery):
 # --- Запуск бота ---
 async def main():
     bot = Bot(token=TG_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+    # Очередь исходящих сообщений с лимитами Telegram (без 429 под нагрузкой)
+    send_scheduler = SendScheduler()
+    bot.session.middleware(send_scheduler)
+    # Состояния диалогов переживают перезапуск; запись на диск идёт пакетами
+    dp = Dispatcher(storage=SQLiteStorage("fsm_storage_tg04.db"))
     dp.include_router(router)
-    await dp.start_polling(bot)
+    setup_metrics(dp)
+    update_scheduler = setup_update_scheduler(dp)  # чаты параллельно, внутри чата — по порядку
+    # Остановка по порядку регистрации: сначала дорабатывает очередь обновлений,
+    # затем закрывается то, чем пользуются обработчики. Хранилище FSM Dispatcher
+    # закрывает первым, а обработчики из очереди открывают его заново — закрываем ещё раз
+    dp.shutdown.register(update_scheduler.close)
+    dp.shutdown.register(dp.storage.close)
+    dp.shutdown.register(send_scheduler.close)
+    await run_bot(dp, bot)  # polling или вебхук (BOT_MODE)
 
 if __name__ == "__main__":
     import asyncio
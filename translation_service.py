@@ -0,0 +1,70 @@
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+from googletrans import Translator
+
+from aio_utils import LRUCache, SingleFlight
+from metrics import track_external
+from resilience import Upstream
+
+# --- Настройки переводчика ---
+TRANSLATION_CACHE_SIZE = 10_000   # записей
+TRANSLATION_CACHE_TTL = 24 * 3600  # секунд
+TRANSLATION_WORKERS = 2
+
+
+class TranslationService:
+    """
+    Долгоживущий переводчик: один экземпляр Translator на весь бот,
+    LRU+TTL-кэш по (текст, src, dest) и объединение одновременных запросов
+    одного и того же текста в один вызов translate().
+    Разные тексты в один запрос не склеиваются: translate(list) в googletrans —
+    всё равно отдельный HTTP-запрос на каждый текст.
+    """
+
+    def __init__(self, cache_size: int = TRANSLATION_CACHE_SIZE, cache_ttl: float = TRANSLATION_CACHE_TTL,
+                 workers: int = TRANSLATION_WORKERS):
+        self._translator = Translator()
+        self._cache = LRUCache(cache_size, ttl=cache_ttl)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="translate")
+        self._flight = SingleFlight()
+        self._upstream = Upstream("googletrans")
+
+    async def translate(self, text: str, src: str = 'auto', dest: str = 'en') -> str:
+        """
+        Переводит текст и возвращает строку перевода.
+        :param text: исходный текст
+        :param src: язык оригинала ('auto' — определить автоматически)
+        :param dest: язык перевода
+        """
+        key = (text, src, dest)
+        translated = self._cache.get(key)
+        if translated is not None:
+            return translated
+
+        return await self._flight.do(key, lambda: self._translate_and_cache(key))
+
+    async def _translate_and_cache(self, key: tuple[str, str, str]) -> str:
+        text, src, dest = key
+        translation = await self._upstream.call(lambda: self._call_translator(text, src, dest))
+        self._cache.set(key, translation.text)
+        return translation.text
+
+    async def _call_translator(self, text: str, src: str, dest: str):
+        async with track_external("googletrans"):
+            if inspect.iscoroutinefunction(self._translator.translate):
+                # googletrans 4.x уже асинхронный — поток не нужен
+                return await self._translator.translate(text, src=src, dest=dest)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, lambda: self._translator.translate(text, src=src, dest=dest))
+
+    async def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        # HTTP-клиент Translator: httpx.AsyncClient в googletrans 4.x, httpx.Client в 3.x
+        client = getattr(self._translator, "client", None)
+        if hasattr(client, "aclose"):
+            await client.aclose()
+        elif hasattr(client, "close"):
+            client.close()
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from gtts import gTTS, gTTSError
+
+from aio_utils import LRUCache, SingleFlight
+from metrics import track_external
+from resilience import AdaptiveLimiter, Upstream
+
+# --- Настройки кэша озвучки ---
+TTS_CACHE_DIR = "tts_cache"
+TTS_MEMORY_LIMIT = 32 * 1024 * 1024   # байт аудио в памяти
+TTS_DISK_LIMIT = 512 * 1024 * 1024    # байт аудио на диске
+TTS_WORKERS = 4
+TTS_TIMEOUT = 10.0                    # секунд на один запрос к Google TTS
+
+
+class TTSCache:
+    """
+    Синтез речи через gTTS с кэшированием по (текст, язык).
+    Синтез и работа с диском выполняются в пуле потоков, чтобы не блокировать event loop.
+    Кэш двухуровневый: LRU в памяти и LRU-каталог на диске, оба ограничены по размеру.
+    """
+
+    def __init__(self, cache_dir: str = TTS_CACHE_DIR, memory_limit: int = TTS_MEMORY_LIMIT,
+                 disk_limit: int = TTS_DISK_LIMIT, workers: int = TTS_WORKERS):
+        self.cache_dir = cache_dir
+        self.disk_limit = disk_limit
+        self._memory = LRUCache(memory_limit, weigher=len)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+        self._flight = SingleFlight()
+        # Одновременных синтезов не больше, чем потоков в пуле: лишние ждут не дольше max_wait
+        self._upstream = Upstream("gtts", limiter=AdaptiveLimiter("gtts", initial=workers, max_limit=workers),
+                                  attempt_timeout=TTS_TIMEOUT + 1, failure_types=(gTTSError,))
+        # имя файла -> размер, в порядке от давно использованных к недавним
+        self._disk_index: dict[str, int] = {}
+        self._disk_size = 0
+        self._disk_loaded = False
+        self._disk_lock = threading.Lock()  # индекс диска меняется из потоков пула
+
+    @staticmethod
+    def cache_key(text: str, lang: str) -> str:
+        return hashlib.sha256(f"{lang}\0{text}".encode("utf-8")).hexdigest()
+
+    async def synthesize(self, text: str, lang: str = 'en') -> bytes:
+        """
+        Возвращает аудио для текста: из памяти, с диска или после синтеза.
+        :param text: текст, который нужно озвучить
+        :param lang: язык озвучки
+        """
+        key = self.cache_key(text, lang)
+        audio = self._memory.get(key)
+        if audio is not None:
+            return audio
+        # Одинаковые фразы, запрошенные одновременно, синтезируются один раз
+        return await self._flight.do(key, lambda: self._load_or_synthesize(key, text, lang))
+
+    async def _load_or_synthesize(self, key: str, text: str, lang: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        if not self._disk_loaded:
+            await loop.run_in_executor(self._executor, self._load_disk_index)
+
+        audio = None
+        if key in self._disk_index:
+            audio = await loop.run_in_executor(self._executor, self._read_disk, key)
+        if audio is None:
+            audio = await self._upstream.call(lambda: self._synthesize_remote(text, lang))
+            await loop.run_in_executor(self._executor, self._write_disk, key, audio)
+
+        self._memory.set(key, audio)
+        return audio
+
+    async def _synthesize_remote(self, text: str, lang: str) -> bytes:
+        async with track_external("gtts"):
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._synthesize_sync, text, lang)
+
+    @staticmethod
+    def _synthesize_sync(text: str, lang: str) -> bytes:
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=lang, timeout=TTS_TIMEOUT).write_to_fp(buffer)
+        return buffer.getvalue()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _load_disk_index(self):
+        # Каталог сканируется один раз; порядок LRU восстанавливаем по времени изменения
+        with self._disk_lock:
+            if not self._disk_loaded:
+                self._scan_disk()
+
+    def _scan_disk(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".mp3"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_size += size
+        self._disk_loaded = True
+        self._evict_disk()
+
+    def _read_disk(self, key: str) -> bytes | None:
+        try:
+            with open(self._path(key), "rb") as f:
+                audio = f.read()
+            os.utime(self._path(key))  # отмечаем использование для LRU после рестарта
+        except OSError:
+            with self._disk_lock:
+                self._disk_size -= self._disk_index.pop(key, 0)
+            return None
+        with self._disk_lock:
+            if key in self._disk_index:
+                self._disk_index[key] = self._disk_index.pop(key)
+        return audio
+
+    def _write_disk(self, key: str, audio: bytes):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Ошибка записи кэша озвучки: {e}")
+            return
+        with self._disk_lock:
+            self._disk_size -= self._disk_index.pop(key, 0)
+            self._disk_index[key] = len(audio)
+            self._disk_size += len(audio)
+            self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_limit and self._disk_index:
+            old_key = next(iter(self._disk_index))
+            self._disk_size -= self._disk_index.pop(old_key)
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,127 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from aiogram import Dispatcher, loggers
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import TelegramObject
+
+from metrics import Gauge, REGISTRY
+
+# --- Настройки планировщика обновлений ---
+UPDATE_CONCURRENCY = 32     # обновлений из разных чатов обрабатывается одновременно
+UPDATE_QUEUE_SIZE = 1000    # обновлений в очереди, после чего приём новых ждёт
+
+UPDATES_PENDING = Gauge("bot_updates_pending", "Обновлений в очереди и в обработке")
+UPDATES_RUNNING = Gauge("bot_updates_running", "Обновлений обрабатывается сейчас")
+REGISTRY.extend([UPDATES_PENDING, UPDATES_RUNNING])
+
+
+class UpdateScheduler:
+    """
+    Первый outer-middleware обновлений: ErrorsMiddleware, контекст пользователя, FSM
+    и обработчики работают уже в задаче, которая обрабатывает обновление.
+    - обновления одного чата обрабатываются строго по порядку, по одному;
+    - разные чаты обрабатываются параллельно, не больше concurrency одновременно;
+    - если в очереди max_pending обновлений, приём следующего ждёт свободного места:
+      при polling перестаёт забирать getUpdates, при вебхуке задерживает ответ Telegram.
+    Обновление принимается в очередь, и feed_update сразу возвращается,
+    поэтому медленный /voice_en одного пользователя не задерживает остальных.
+    Подключение: setup_update_scheduler(dp)
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_QUEUE_SIZE):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._running = asyncio.Semaphore(concurrency)
+        self._free_slots = asyncio.Semaphore(max_pending)
+        self._queues: dict[Any, deque] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: dict[str, Any]) -> Any:
+        await self._free_slots.acquire()  # backpressure: ждём, пока очередь не освободится
+        UPDATES_PENDING.inc()
+        key = self._chat_key(event)
+        item = (handler, event, data)
+        if key is None:
+            # Без чата и пользователя упорядочивать нечего
+            self._spawn(self._process(item))
+            return None
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(item)
+            return None
+        self._queues[key] = deque([item])
+        self._spawn(self._drain(key))
+        return None
+
+    @staticmethod
+    def _chat_key(event: TelegramObject) -> Any:
+        context = UserContextMiddleware.resolve_event_context(event)
+        if context.chat is not None:
+            return context.chat.id
+        if context.user is not None:
+            return "user", context.user.id
+        return None
+
+    def _spawn(self, coroutine: Awaitable[Any]):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key: Any):
+        # Один обработчик очереди на чат: следующее обновление чата — только после предыдущего
+        queue = self._queues[key]
+        while queue:
+            await self._process(queue[0])
+            queue.popleft()
+        del self._queues[key]
+
+    async def _process(self, item: tuple):
+        handler, event, data = item
+        try:
+            async with self._running:
+                UPDATES_RUNNING.inc()
+                try:
+                    await handler(event, data)
+                finally:
+                    UPDATES_RUNNING.dec()
+        except Exception as e:
+            # Обработчики dp.errors ошибку уже получили (ErrorsMiddleware внутри цепочки), сюда доходят
+            # только необработанные — как и при polling, пишем в лог, очередь чата продолжает работу
+            loggers.event.exception("Ошибка при обработке update id=%s: %s: %s",
+                                    getattr(event, "update_id", None), type(e).__name__, e)
+        finally:
+            UPDATES_PENDING.dec()
+            self._free_slots.release()
+
+    async def join(self):
+        """
+        Ждёт, пока будут обработаны все принятые обновления.
+        """
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    close = join
+
+
+def setup_update_scheduler(dp: Dispatcher, concurrency: int = UPDATE_CONCURRENCY,
+                           max_pending: int = UPDATE_QUEUE_SIZE) -> UpdateScheduler:
+    """
+    Подключает планировщик первым outer-middleware обновлений: состояние чата читается,
+    когда до обновления дошла очередь, а не в момент приёма, а ошибки обработчиков
+    проходят через ErrorsMiddleware и dp.errors, как без планировщика.
+    run_bot видит его в dp["update_scheduler"] и принимает обновления без лишних задач.
+    Остановку вызывающий регистрирует сам: dp.shutdown.register(scheduler.close)
+    раньше обработчиков, которые закрывают то, чем пользуются хендлеры.
+    """
+    scheduler = UpdateScheduler(concurrency, max_pending)
+    middlewares = list(dp.update.outer_middleware)
+    for middleware in middlewares:
+        dp.update.outer_middleware.unregister(middleware)
+    dp.update.outer_middleware(scheduler)
+    for middleware in middlewares:
+        dp.update.outer_middleware(middleware)
+    dp["update_scheduler"] = scheduler
+    return scheduler
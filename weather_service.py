@@ -0,0 +1,44 @@
+import os
+
+import httpx
+
+from config import OPENWEATHER_API_KEY
+from aio_utils import SingleFlight
+from http_client import get_http_client
+from metrics import track_external
+from resilience import AdaptiveLimiter, Quota, Upstream
+
+OPENWEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+# Суточная квота запросов (бесплатный тариф OpenWeather — 60 в минуту и 1 000 000 в месяц); 0 — только считать
+OPENWEATHER_DAILY_QUOTA = int(os.getenv("OPENWEATHER_DAILY_QUOTA", "0"))
+
+# Одновременные запросы погоды для одного города идут в OpenWeather одним вызовом
+_weather_flight = SingleFlight()
+# Адаптивный лимит, повторы и предохранитель: при сбоях OpenWeather обработчики не копятся
+_weather_upstream = Upstream("openweather", limiter=AdaptiveLimiter("openweather", initial=10, max_limit=50),
+                             quota=Quota("openweather", OPENWEATHER_DAILY_QUOTA or None))
+
+
+async def fetch_weather(city: str) -> tuple[int, dict]:
+    """
+    Запрашивает текущую погоду в OpenWeather.
+    :param city: название города
+    :return: (HTTP-статус, распарсенный JSON-ответ)
+    :raises resilience.UpstreamUnavailable: OpenWeather сейчас недоступен, запрос не отправлялся
+    """
+    async def attempt():
+        params = {"q": city, "appid": OPENWEATHER_API_KEY, "units": "metric", "lang": "ru"}
+        async with track_external("openweather"):
+            response = await get_http_client().get(OPENWEATHER_URL, params=params)
+        if response.status_code == 429 or response.status_code >= 500:
+            # Перегрузка или сбой сервиса — исключение, чтобы сработали повтор и предохранитель
+            response.raise_for_status()
+        return response.status_code, response.json()
+
+    async def request():
+        try:
+            return await _weather_upstream.call(attempt)
+        except httpx.HTTPStatusError as e:
+            return e.response.status_code, {}
+
+    return await _weather_flight.do(city.strip().lower(), request)
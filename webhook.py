@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import time
+
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+# --- Настройки режима работы (переменные окружения) ---
+# BOT_MODE=polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token: без него обновления мог бы прислать кто угодно.
+# Если не задан, а вебхук регистрирует сам бот (WEBHOOK_BASE_URL), генерируется случайный
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Публичный адрес для setWebhook; если не задан, вебхук регистрируется вручную
+# (например, когда несколько экземпляров стоят за балансировщиком)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+
+
+def build_webhook_app(dp: Dispatcher, bot: Bot, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET) -> web.Application:
+    """
+    Создаёт aiohttp-приложение, принимающее обновления от Telegram.
+    Запрос подтверждается сразу, а обработка идёт в фоне (handle_in_background).
+    С планировщиком обновлений ответ ждёт постановки в его очередь: когда она полна,
+    Telegram получает ответ позже и сам придерживает следующие обновления.
+    :param secret: обязательный секрет; запросы без него или с другим отклоняются
+    """
+    if not secret:
+        raise ValueError("Вебхук без секрета принимает поддельные обновления от кого угодно")
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret,
+        handle_in_background="update_scheduler" not in dp.workflow_data,
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                      path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET, base_url: str = WEBHOOK_BASE_URL):
+    """
+    Запускает бота в режиме вебхука и работает, пока задачу не отменят.
+    """
+    if not secret:
+        if not base_url:
+            # Вебхук зарегистрирован вручную — случайный секрет Telegram не узнает
+            raise RuntimeError("BOT_MODE=webhook: задайте WEBHOOK_SECRET (тот же, что передан в setWebhook)")
+        secret = secrets.token_urlsafe(32)
+        print("WEBHOOK_SECRET не задан — для setWebhook сгенерирован случайный секрет")
+
+    if base_url:
+        async def set_webhook():
+            await bot.set_webhook(f"{base_url.rstrip('/')}{path}", secret_token=secret)
+        dp.startup.register(set_webhook)
+
+    runner = web.AppRunner(build_webhook_app(dp, bot, path, secret))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Вебхук слушает http://{host}:{port}{path}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
+
+async def run_bot(dp: Dispatcher, bot: Bot):
+    """
+    Запускает бота в режиме, выбранном через BOT_MODE.
+    """
+    if BOT_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        # Планировщик сам раздаёт обновления по задачам; без него — задача на каждое обновление
+        await dp.start_polling(bot, handle_as_tasks="update_scheduler" not in dp.workflow_data)
+
+
+# --- Локальный «Telegram» для проверки вебхука ---
+def fake_message_update(update_id: int, text: str, chat_id: int = 1, user_id: int = 1) -> dict:
+    """
+    Собирает минимальное обновление с текстовым сообщением.
+    """
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+async def send_fake_updates(url: str, updates: list[dict], secret: str = WEBHOOK_SECRET) -> list[int]:
+    """
+    Отправляет обновления на вебхук так же, как это делает Telegram.
+    :return: HTTP-статусы ответов
+    """
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    statuses = []
+    async with ClientSession() as session:
+        for update in updates:
+            async with session.post(url, json=update, headers=headers) as response:
+                statuses.append(response.status)
+    return statuses
+
+
+if __name__ == "__main__":
+    # Пример: python webhook.py --url http://127.0.0.1:8080/webhook --text /start --text /help
+    parser = argparse.ArgumentParser(description="Отправка тестовых обновлений на вебхук бота")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    parser.add_argument("--text", action="append", help="текст сообщения (можно несколько)")
+    parser.add_argument("--file", help="JSONL-файл с готовыми обновлениями")
+    parser.add_argument("--chat-id", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            fake_updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        fake_updates = [fake_message_update(i, text, chat_id=args.chat_id)
+                        for i, text in enumerate(args.text or ["/start"], start=1)]
+    print(asyncio.run(send_fake_updates(args.url, fake_updates, args.secret)))